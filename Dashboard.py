@@ -1,18 +1,380 @@
 import streamlit as st
-import plotly.express as px
 import numpy as np
 import pandas as pd
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from datastore import CLEANED_CSV, CLEANED_FEATHER, CLEANED_SCHEMA, CLEANED_CUBE, CLEANED_BALANCES, CLEANED_TRENDS, file_hash, read_schema, open_feather, feather_columns, read_cleaned_csv
+from cube import build_cube, read_cube, cube_table, cube_source_columns
+from balances import build_balances, read_balances, unused_grants, balance_source_columns
+from trends import build_trends, read_trends, trend_table, trend_types, trend_source_columns
+
+# Every session in this process shares one copy of the data set (see loadData below), so nothing a page does
+# may ever write into it.  Copy-on-Write makes pandas guarantee that: frames built from the shared columns don't
+# copy anything until something writes to them, and then only the column being written gets copied, into that
+# frame alone.  It's always on from pandas 3
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Columns that exist solely for data preservation (or are placeholders left over from the raw sheet)
+# and never get shown on a page
+preservationColumns = ['Payment Submitted? Boolean', 'YOB', 'Payment Method Original']
+
+# Worked out by main.py for the pages' math (so they never parse a date), and not meant for the tables either
+derivedColumns = ['grant_year', 'days_request_to_payment', 'age_at_request']
+
+
+# Streamlit reruns this whole file every time someone touches a widget, so a plain read_csv up here meant
+# re-parsing the entire file on every single click.  st.cache_resource hands back the same object to every
+# rerun and every session in this process, which makes it a good home for the opened data set.
+#
+# When main.py writes a new version of the cleaned files, a watcher thread (started along with the cache) opens
+# it, gets it ready to the same point the old one was at (same columns converted, same filter indexes, cube,
+# balances and trends loaded) and only then swaps it in, in one assignment.  So nobody's click ever waits on a reload, and
+# every rerun grabs whichever version is current when it starts (see `dataset` at the bottom) and uses that one
+# all the way through, even if a swap lands halfway.  The old version sticks around until the last rerun using
+# it is done.
+
+watchInterval = 5 # Seconds between the watcher's looks at the cleaned files
+
+logger = logging.getLogger(__name__)
+
+@st.cache_resource
+def datasetCache():
+    # The directory is pinned now, so the watcher keeps looking in the right place whatever the working directory does
+    cache = {'lock': threading.Lock(), 'directory': os.getcwd(), 'entry': None}
+    threading.Thread(target = watchDataset, args = (cache,), name = "dataset watcher", daemon = True).start()
+    return cache
+
+def datasetPath(cache):
+    feather = os.path.join(cache['directory'], CLEANED_FEATHER)
+    return feather if os.path.exists(feather) else os.path.join(cache['directory'], CLEANED_CSV)
+
+# main.py writes a memory-mapped friendly feather file next to the csv.  If it's there it gets mapped,
+# otherwise the csv is read with the types recorded in the schema sidecar.
+def openDataset(cache, path, digest = None):
+    mtime = os.stat(path).st_mtime_ns
+    digest = file_hash(path) if digest is None else digest
+    table = open_feather(path) if path.endswith(CLEANED_FEATHER) else None # Streamlit itself depends on pyarrow, so it's always here
+    schema = read_schema(os.path.join(cache['directory'], CLEANED_SCHEMA))
+    return {
+        'path': path,
+        'mtime': mtime,
+        'hash': digest,
+        'version': schema.get('version') or digest, # The same however main.py split the rows up, unlike the file's own hash
+        'loaded': datetime.now(), # When this version was swapped in (or first opened)
+        'schema': schema,
+        'table': table,
+        'series': {}, # Columns already converted to pandas, filled in as pages ask for them
+        'cube': None, # Support Given's totals, loaded the first time that page is opened
+        'balances': None, # Grant Usage's final balance per requestor and grant year, loaded the same way as the cube
+        'trends': None, # The Trends page's month by month rollup, loaded the same way again
+        'indexes': {}, # Row positions for each value of a filter (see filterRows below), built as filters get used
+        'displayColumns': [column['name'] for column in schema['columns']
+                           if column['name'] not in preservationColumns + derivedColumns and not column['name'].startswith('Unnamed')]
+    }
+
+def currentDataset():
+    cache = datasetCache()
+    with cache['lock']:
+        if cache['entry'] is None: # Only the very first rerun in the process has to wait for the file to open
+            cache['entry'] = openDataset(cache, datasetPath(cache))
+        return cache['entry']
+
+def watchDataset(cache):
+    # A failure is most likely a file main.py is halfway through replacing.  The current version stays and it's
+    # tried again next time, but it's logged (once per different error, so a stuck one doesn't flood the log) so a
+    # reload that keeps failing doesn't go unnoticed
+    lastError = None
+    while True:
+        time.sleep(watchInterval)
+        try:
+            refreshDataset(cache)
+            lastError = None
+        except Exception as error:
+            if repr(error) != lastError:
+                logger.warning("Couldn't reload the cleaned data set, still showing the current version", exc_info = True)
+            lastError = repr(error)
+
+def refreshDataset(cache):
+    # A matching mtime is trusted outright, and if the mtime moved (a fresh checkout, main.py re-running without
+    # changing anything) the content hash gets the final say
+    entry = cache['entry']
+    if entry is None:
+        return
+    path = datasetPath(cache)
+    mtime = os.stat(path).st_mtime_ns
+    if path == entry['path'] and mtime == entry['mtime']:
+        return
+    digest = file_hash(path)
+    if path == entry['path'] and digest == entry['hash']:
+        entry['mtime'] = mtime
+        return
+
+    fresh = openDataset(cache, path, digest)
+    written = fresh['schema'].get('feather_hash' if path.endswith(CLEANED_FEATHER) else 'version')
+    if written not in (None, digest):
+        return # main.py hasn't written this file's schema yet
+
+    # Sessions keep adding to the current version's columns and indexes, so what it has is copied under the lock.
+    # Nobody else can see fresh yet, so getting it ready doesn't need the lock.  Anything that can't be got ready
+    # (a column the new version dropped, say) is logged and just left for a page to load the usual way
+    with cache['lock']:
+        loadedColumns = list(entry['series'])
+        builtIndexes = list(entry['indexes'])
+        extras = [load for load, key in [(entryCube, 'cube'), (entryBalances, 'balances'), (entryTrends, 'trends')] if entry[key] is not None]
+    try:
+        freshColumns = {column['name'] for column in fresh['schema']['columns']}
+        entryColumns(fresh, [column for column in loadedColumns if column in freshColumns])
+        for name in builtIndexes:
+            filterIndex(fresh, name)
+        for load in extras:
+            load(fresh)
+    except Exception:
+        logger.warning("Couldn't get everything ready on the new data set, pages will load the rest", exc_info = True)
+
+    fresh['loaded'] = datetime.now()
+    with cache['lock']:
+        cache['entry'] = fresh
+
+# The one way a page gets its data.  Only the requested columns are ever converted (or parsed), and each one
+# only once per file version, and those columns are shared by every session.  The frame handed back is just a
+# new wrapper around them (no copying, so another user costs next to no memory), and thanks to Copy-on-Write
+# a page that adds or overwrites a column on it only changes its own frame, never what everyone else sees.
+def loadData(columns = None):
+    with datasetCache()['lock']:
+        return entryColumns(dataset, dataset['displayColumns'] if columns is None else columns)
+
+def entryColumns(entry, columns):
+    missing = [column for column in columns if column not in entry['series']]
+    if missing:
+        if entry['table'] is not None:
+            loaded = feather_columns(entry['table'], missing, entry['schema'])
+        else:
+            loaded = read_cleaned_csv(entry['path'], entry['schema'], missing)
+        entry['series'].update(loaded.items())
+
+    return pd.DataFrame({column: entry['series'][column] for column in columns}, copy = False)
+
+# main.py precomputes Support Given's numbers (see cube.py), so that page is a lookup instead of a groupby over
+# everything.  The cube is only trusted if it was built from the exact file that's open and this year's ages.
+# If not (an older main.py, or the year rolled over since the last clean) it gets built here instead, once per
+# file version, which is still better than once per click.
+def supportCube():
+    with datasetCache()['lock']:
+        return entryCube(dataset)
+
+def entryCube(entry):
+    if entry['cube'] is None:
+        cubePath = os.path.join(os.path.dirname(entry['path']), CLEANED_CUBE)
+        cube = read_cube(cubePath) if os.path.exists(cubePath) else None
+        if cube is None or cube['version'] != entry['schema'].get('version') or cube['as_of_year'] != datetime.today().year:
+            cube = build_cube(entryColumns(entry, cube_source_columns), datetime.today().year)
+        entry['cube'] = cube
+    return entry['cube']
+
+# Same deal for the final balance of every requestor in every grant year (see balances.py)
+def balanceTable():
+    with datasetCache()['lock']:
+        return entryBalances(dataset)
+
+def entryBalances(entry):
+    if entry['balances'] is None:
+        balancesPath = os.path.join(os.path.dirname(entry['path']), CLEANED_BALANCES)
+        version, table = read_balances(balancesPath) if os.path.exists(balancesPath) else (None, None)
+        if table is None or version != entry['schema'].get('version'):
+            table = build_balances(entryColumns(entry, balance_source_columns))
+        entry['balances'] = table
+    return entry['balances']
+
+# And the month by month rollup behind the Trends page (see trends.py)
+def trendStore():
+    with datasetCache()['lock']:
+        return entryTrends(dataset)
+
+def entryTrends(entry):
+    if entry['trends'] is None:
+        trendsPath = os.path.join(os.path.dirname(entry['path']), CLEANED_TRENDS)
+        trends = read_trends(trendsPath) if os.path.exists(trendsPath) else None
+        if trends is None or trends['version'] != entry['schema'].get('version'):
+            trends = build_trends(entryColumns(entry, trend_source_columns))
+        entry['trends'] = trends
+    return entry['trends']
+
+
+# Tables.  Handing st.data_editor a whole filtered frame ships every row and every column of it to the browser on
+# every rerun, which with a few years of grants is megabytes per click.  pagedTable() does the sorting and paging
+# here instead and only ever sends the page being looked at, in just the columns picked (the defaults below,
+# unless someone asks for more).  The full result is only turned into a csv if someone clicks to download it.
+
+# What each table starts out showing
+statusTableColumns = ['Patient ID#', 'Grant Req Date', 'Request Status', 'Application Signed?', 'Reason - Pending/No',
+                      'Type of Assistance (CLASS)', ' Amount ', 'Payment Method', 'Notes']
+usageTableColumns = ['Patient ID#', 'Grant Req Date', 'App Year', 'Type of Assistance (CLASS)', ' Amount ',
+                     ' Remaining Balance ', 'Payment Method', 'Request Status']
+
+pageSizes = [25, 50, 100, 250, 500]
+
+# frame is the page's full (shared, uncopied) frame and rows picks the rows in the result, as row positions
+# (what filterRows hands back) or None for all of them.  key keeps each table's widgets apart
+def pagedTable(frame, rows, key, defaultColumns = None):
+    positions = np.arange(len(frame)) if rows is None else rows
+    allColumns = list(frame.columns)
+    defaultColumns = [column for column in (defaultColumns or allColumns) if column in allColumns]
+
+    columns = st.multiselect("Columns", allColumns, default = defaultColumns, key = f"{key}_columns")
+    if not columns:
+        columns = defaultColumns
+
+    sortCol, orderCol, sizeCol, pageCol = st.columns([3, 2, 2, 2])
+    sortBy = sortCol.selectbox("Sort by", [None, *columns], format_func = lambda column: "Sheet order" if column is None else column.strip(),
+                               key = f"{key}_sort")
+    ascending = orderCol.radio("Order", ["Ascending", "Descending"], horizontal = True, key = f"{key}_order") == "Ascending"
+    pageSize = sizeCol.selectbox("Rows per page", pageSizes, key = f"{key}_size")
+
+    # Only the one column being sorted on gets sorted, and the rest just follow the order it hands back
+    if sortBy is not None:
+        sortValues = frame[sortBy].iloc[positions].reset_index(drop = True)
+        order = sortValues.sort_values(ascending = ascending, kind = 'stable', na_position = 'last').index.to_numpy()
+        positions = positions[order]
+    elif not ascending:
+        positions = positions[::-1]
+
+    pages = max(1, -(-len(positions) // pageSize))
+    pageKey = f"{key}_page"
+    if st.session_state.get(pageKey, 1) > pages: # A narrower filter can leave someone past the last page
+        st.session_state[pageKey] = pages
+    page = pageCol.number_input(f"Page (of {pages})", min_value = 1, max_value = pages, step = 1, key = pageKey)
+
+    start = (page - 1) * pageSize
+    st.dataframe(frame[columns].iloc[positions[start:start + pageSize]])
+    st.caption(f"Showing rows {min(start + 1, len(positions))}-{min(start + pageSize, len(positions))} of {len(positions)}")
+
+    # A callable only runs when the button is actually clicked, on its own thread, so the csv of the whole
+    # result is never built just to draw the page
+    st.download_button("Download all rows as CSV", data = lambda: frame[columns].iloc[positions].to_csv(index = False),
+                       file_name = f"{key}.csv", mime = 'text/csv', on_click = 'ignore', key = f"{key}_download")
+
+
+# Filter indexes.  Rather than comparing a whole column against the selection on every submit, each filter gets
+# an index built once per file version: every value it takes, mapped to the (sorted) row positions holding it,
+# with blanks kept under None.  A selection is then just those position arrays put together, unioned within a
+# filter and intersected across filters.  Any column works as a filter as is; filterKeys only lists the ones that
+# are worked out from a column rather than read straight off it.
+filterKeys = {
+    # 'unused' when there's money left on the grant, 'used' when there isn't, and None when nobody wrote it down
+    'Balance Class': ([' Remaining Balance '], lambda frame: pd.Series(
+        np.select([frame[' Remaining Balance '] > 0, frame[' Remaining Balance '] <= 0], ['unused', 'used'], None), dtype = object))
+}
 
-df = pd.read_csv("Cleaned Data Set.csv", index_col = 0)
-df = df.drop('Payment Submitted? Boolean', axis = 1) # Removing columns that exist solely for data preservation
-dfYOB = df # Sort of a data preservation secondary data frame
-df = df.drop('YOB', axis = 1)
-df = df.drop('Payment Method Original', axis = 1)
+def buildIndex(keys):
+    codes, uniques = pd.factorize(keys, use_na_sentinel = True)
+    order = np.argsort(codes, kind = 'stable') # Stable, so every value's positions come out already sorted
+    bounds = np.searchsorted(codes[order], np.arange(-1, len(uniques) + 1))
+    index = {None: order[bounds[0]:bounds[1]]}
+    for code, value in enumerate(pd.Index(uniques).tolist()):
+        index[value] = order[bounds[code + 1]:bounds[code + 2]]
+    return index
+
+def filterIndex(entry, name):
+    if name not in entry['indexes']:
+        columns, keys = filterKeys.get(name, ([name], lambda frame: frame[name]))
+        entry['indexes'][name] = buildIndex(keys(entryColumns(entry, columns)))
+    return entry['indexes'][name]
+
+# filters looks like {'Request Status': ['Pending'], 'Application Signed?': [False, None]}, any of the listed values
+# matching for each filter, and every filter having to match.  Hands back the matching row positions, in order
+def filterRows(filters):
+    with datasetCache()['lock']:
+        rows = None
+        for name, values in filters.items():
+            index = filterIndex(dataset, name)
+            matches = [index[value] for value in values if value in index]
+            matched = np.sort(np.concatenate(matches)) if matches else np.array([], dtype = np.intp)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique = True)
+        return rows # None when there were no filters at all, which pagedTable takes as every row
+
+
+# Page results.  Most reruns are someone paging through a table or switching back to a page they've already seen,
+# with the data and their choices the same as last time, so each page's numbers are kept in one cache shared by
+# every session in this process.  A result is filed under the data version it came from, the page and the
+# choices that went into it (put in a fixed order, so the same choices always make the same key), so a new
+# version of the data just stops matching the old entries rather than needing anything cleared.  The cache
+# holds at most resultCacheBytes of results and drops whichever was used longest ago to make room.
+#
+# Whatever is handed back is shared, so it must never be changed in place.  Frames are covered by Copy-on-Write
+# (see the top of the file) and arrays are made read-only before they go in.
+
+resultCacheBytes = 64 * 2**20
+
+@st.cache_resource
+def resultCache():
+    return {'lock': threading.Lock(), 'entries': OrderedDict(), 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+def normalizeSelection(selection):
+    # Dicts by key and lists and sets by value, so {'a': [2, 1]} and {'a': [1, 2]} are the same selection
+    if isinstance(selection, dict):
+        return tuple(sorted((key, normalizeSelection(value)) for key, value in selection.items()))
+    if isinstance(selection, (list, tuple, set, frozenset)):
+        return tuple(sorted((normalizeSelection(value) for value in selection), key = repr))
+    return selection
+
+def resultSize(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return int(result.memory_usage(deep = True).sum()) if isinstance(result, pd.DataFrame) else int(result.memory_usage(deep = True))
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sys.getsizeof(result) + sum(resultSize(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sys.getsizeof(result) + sum(resultSize(value) for value in result)
+    return sys.getsizeof(result)
+
+def readOnly(result):
+    if isinstance(result, np.ndarray):
+        result.setflags(write = False)
+    elif isinstance(result, dict):
+        for value in result.values():
+            readOnly(value)
+    return result
+
+def cachedResult(page, selection, compute):
+    # compute runs outside the lock, so a slow page never holds up anyone else's lookups
+    cache = resultCache()
+    key = (dataset['version'], page, normalizeSelection(selection))
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['entries'].move_to_end(key)
+            cache['hits'] += 1
+            return cache['entries'][key][0]
+        cache['misses'] += 1
+
+    result = readOnly(compute())
+    size = resultSize(result)
+    with cache['lock']:
+        if key not in cache['entries'] and size <= resultCacheBytes:
+            cache['entries'][key] = (result, size)
+            cache['bytes'] += size
+            while cache['bytes'] > resultCacheBytes:
+                _, (_, evicted) = cache['entries'].popitem(last = False)
+                cache['bytes'] -= evicted
+                cache['evictions'] += 1
+    return result
+
+def resultCachePanel():
+    cache = resultCache()
+    with cache['lock']:
+        hits, misses, evictions = cache['hits'], cache['misses'], cache['evictions']
+        entries, used = len(cache['entries']), cache['bytes']
+    with st.sidebar.expander("Result cache (debug)"):
+        st.write(f"Hits: {hits}  \nMisses: {misses}  \nEvictions: {evictions}")
+        st.write(f"Hit rate: {hits / (hits + misses):.0%}" if hits + misses else "Hit rate: -")
+        st.write(f"{entries} results, {used / 2**20:.2f} of {resultCacheBytes / 2**20:.0f} MB")
 
-# Some columns are apparently placeholders produced by some of the cleaning code,
-# This code removes those placeholder columns after loading the data in
-df = df.loc[:, ~df.columns.str.contains('^Unnamed', regex = True)]
 
 # Initial formatting
 st.set_page_config(
@@ -44,67 +406,53 @@ def appsReadyForReview():
 
         st.form_submit_button(label = "Filter by Selection")
 
-        if coerceNaToNo == True:
-            dfrr = df
-            dfrr['Application Signed?'] = dfrr['Application Signed?'].fillna(False)
-        else:
-            dfrr = df
+    # Unknown signatures are their own entry in the index, so treating them as unsigned is just asking for them too
+    signatures = [sigSelection, None] if coerceNaToNo == True and sigSelection == False else [sigSelection]
+    filters = {'Request Status': [statusSelection], 'Application Signed?': signatures}
+    selected = cachedResult("Application Status", filters, lambda: filterRows(filters))
 
-        dfrr = dfrr.loc[(df['Request Status'] == statusSelection) & (df['Application Signed?'] == sigSelection)]
+    # The coerced signatures get swapped in on this page's frame alone (only that one column is new), and the
+    # table pulls the matching rows out a page at a time.  It sits outside the form so paging doesn't need a submit
+    dfrr = df
+    if coerceNaToNo == True:
+        signed = cachedResult("Application Status", 'unknown signatures as unsigned', lambda: df['Application Signed?'].fillna(False))
+        dfrr = df.assign(**{'Application Signed?': signed})
 
-        st.data_editor(dfrr)
+    pagedTable(dfrr, selected, key = "application_status", defaultColumns = statusTableColumns)
    
 
 # Second page.  Basically this makes a different bar graph based on the selection.
 
 #BUT FIRST. . . A function.  This keeps my displays nice and tidy and shows an average and total support bar graph for each
 def demoSelectionDisplay(column = str, demographic = str):
+    support = cachedResult("Support Given", column, lambda: cube_table(supportCube(), column))
     st.header(f"Average support per grant based on {demographic}")
-    st.bar_chart(df.groupby(column)[' Amount '].mean())
+    st.bar_chart(support['mean'])
     st.header(f"Total support based on {demographic}")
-    st.bar_chart(df.groupby(column)[' Amount '].sum())
+    st.bar_chart(support['sum'])
 
 def supportGiven():
     with st.form(key = "support_given_form"):
-        demographics = ['State', 'Gender', 'Monthly Income', 'Insurance Type', 'Age', 'Type of Assistance', 'Hispanic/Latino?', 'Sexual Orientation', 'Marital Status', 'Race', "Roundtrip Distance"]
+        # Each demographic as the cube column it's kept under and how it reads in the headers
+        demographics = {
+            'State': ('Pt State', 'State'),
+            'Gender': ('Gender', 'Gender'),
+            'Monthly Income': (' Total Household Gross Monthly Income ', 'Monthly Income'),
+            'Insurance Type': ('Insurance Type', 'Insurance Type'),
+            'Age': ('Age', 'Age'), # Age bands, worked out from YOB by main.py
+            'Type of Assistance': ('Type of Assistance (CLASS)', 'Type of Assistance'),
+            'Hispanic/Latino?': ('Hispanic/Latino', 'if Hispanic/Latino'),
+            'Sexual Orientation': ('Sexual Orientation', 'Sexual Orientation'),
+            'Marital Status': ('Marital Status', 'Marital Status'),
+            'Race': ('Race', 'Race'),
+            "Roundtrip Distance": ('Distance roundtrip/Tx', 'Roundtrip Distance')
+        }
 
         st.title("Support Given by Demographic")
         demoSelection = st.selectbox("Select Demographic", demographics)
         st.form_submit_button(label = "Filter by Demographic")
 
-        if demoSelection == 'State':
-            demoSelectionDisplay('Pt State', 'State')
-        
-        elif demoSelection == 'Gender':
-            demoSelectionDisplay('Gender', 'Gender')
-        
-        elif demoSelection == 'Monthly Income':
-            demoSelectionDisplay(' Total Household Gross Monthly Income ', 'Monthly Income')
-        
-        elif demoSelection == 'Insurance Type':
-            demoSelectionDisplay('Insurance Type', 'Insurance Type')
-
-        elif demoSelection == 'Age':
-            df['Age'] = datetime.today().year - dfYOB['YOB'] # Little extra here to actually calculate age
-            demoSelectionDisplay('Age', 'Age')
-
-        elif demoSelection == 'Type of Assistance':
-            demoSelectionDisplay('Type of Assistance (CLASS)', 'Type of Assistance')
-
-        elif demoSelection == 'Hispanic/Latino?':
-            demoSelectionDisplay('Hispanic/Latino', 'if Hispanic/Latino')
-
-        elif demoSelection == 'Sexual Orientation':
-            demoSelectionDisplay('Sexual Orientation', 'Sexual Orientation')
-
-        elif demoSelection == 'Marital Status':
-            demoSelectionDisplay('Marital Status', 'Marital Status')
-        
-        elif demoSelection == 'Race':
-            demoSelectionDisplay('Race', 'Race')
-
-        elif demoSelection == 'Roundtrip Distance':
-            demoSelectionDisplay('Distance roundtrip/Tx', 'Roundtrip Distance')
+        demoSelectionDisplay(*demographics[demoSelection])
 
             
 # Third page setup
@@ -113,65 +461,120 @@ def supportWait():
     st.title("Time Between Request and Payment")
     st.write("Note that any entries missing a specific grant request date or payment date are not included in this data.")
 
-    dft = df
-
-    dft = dft.dropna(axis = 0, subset = 'Grant Req Date')
-    dft = dft.dropna(axis = 0, subset = 'Payment Submitted?')
-
-    dft['Days Between Request and Payment'] = (pd.to_datetime(dft['Payment Submitted?'], errors = 'coerce') - pd.to_datetime(dft['Grant Req Date'], errors = 'coerce')).dt.days.round(2)
-    dft = dft.dropna(axis = 0, subset = 'Days Between Request and Payment')
+    # main.py already worked out the days between the two dates, and left it blank whenever either one is missing
+    def waits():
+        dft = df['days_request_to_payment'].rename('Days Between Request and Payment').dropna().astype(int)
+        return dft.value_counts().sort_index()
     
     # Notably the sorting on streamlit for a timedelta is super scuffed and not at all accurate, so without casting the above into days
     # you really get an incorrect sort.
 
-    st.bar_chart(dft['Days Between Request and Payment'].value_counts().sort_index())
+    st.bar_chart(cachedResult("Waiting Time", None, waits))
 
 # Page 4.  Thankfully a straightforward one, albeit I could have added so much more if I had the time.
 def grantBreakdown():
-    
-
-    
-    dfg = df.loc[(df[' Remaining Balance '] > 0)]
 
+    def usage():
+        unused = filterRows({'Balance Class': ['unused']})
+        # A balance on some request doesn't mean the grant went unused, since every request but the last usually has
+        # one.  What counts is the balance on each requestor's final request of the grant year, which main.py works out
+        unusedGrants = unused_grants(balanceTable()).drop(columns = 'unused').rename(
+            columns = {'grant_year': 'Grant Year', 'Grant Req Date': 'Last Request', ' Remaining Balance ': 'Balance Left'})
+        return {
+            'averageByType': df.groupby('Type of Assistance (CLASS)', observed = True)[' Amount '].mean(),
+            'unusedGrants': unusedGrants,
+            'unusedRequestors': unusedGrants['Patient ID#'].nunique(),
+            'unusedByYear': unusedGrants.groupby('Grant Year').size().rename('Requestors'),
+            'unused': unused,
+            'balanceRequestors': df['Patient ID#'].iloc[unused].nunique()
+        }
+    results = cachedResult("Grant Usage", None, usage)
 
     st.header("Average support per grant based on type of assistance")
-    st.bar_chart(df.groupby('Type of Assistance (CLASS)')[' Amount '].mean())
+    st.bar_chart(results['averageByType'])
 
-    st.header("Dataframe of all grants not fully used")
-    st.write(f"The number of Requestors who did not use their full grant at least once is {dfg["Patient ID#"].nunique()}")
-    st.data_editor(dfg)
+    st.header("Grants not fully used by the end of the grant year")
+    st.write(f"The number of Requestors who did not use their full grant in at least one grant year is {results['unusedRequestors']}")
+    st.bar_chart(results['unusedByYear'])
+    pagedTable(results['unusedGrants'], None, key = "unused_grants")
 
-    # I realized after I had done this and did not have the time that this particular problem is way, way more complicated
-    # than this code gives credit.  To actually solve this, one would have to find the last entry from each requestor in 
-    # each grant year, then see if this value is positive and store all entries into a new column or frame.  This code 
-    # most certainly *does not* do that, but alas, I was out of both time and ideas.
+    st.header("Every request with money left on it")
+    st.write(f"{results['balanceRequestors']} Requestors have a remaining balance on at least one request")
+    pagedTable(df, results['unused'], key = "grant_usage", defaultColumns = usageTableColumns)
 
 def execSummary():
 
     lastYear = datetime.today().year - 1 # Use last year regardless of what year it is
     st.title(f"{lastYear} Executive Summary")
-    dfe = df.loc[(pd.to_datetime(df['Grant Req Date']).dt.year == (datetime.today().year - 1))]
-    dfe = dfe.dropna(axis = 0, subset = ' Amount ') # Only include grants that actually went out
-    dfe['Payment Method'] = dfe['Payment Method'].replace('GC', 'Gift Card') # casting these back for legibility
-    dfe['Payment Method'] = dfe['Payment Method'].replace('CC', 'Credit Card')
-    dfe['Payment Method'] = dfe['Payment Method'].replace('JE', 'Journal Entry')
-    dfe['Payment Method'] = dfe['Payment Method'].replace('CK', 'Check')
+
+    def summary():
+        dfe = df.loc[df['grant_year'] == lastYear]
+        dfe = dfe.dropna(axis = 0, subset = ' Amount ') # Only include grants that actually went out
+        paymentNames = {'GC': 'Gift Card', 'CC': 'Credit Card', 'JE': 'Journal Entry', 'CK': 'Check'} # casting these back for legibility
+        paymentMethods = dfe['Payment Method'].cat.rename_categories(lambda method: paymentNames.get(method, method))
+        return {
+            'individuals': dfe['Patient ID#'].nunique(),
+            'total': dfe[' Amount '].sum().round(2),
+            'grants': dfe[' Amount '].count(),
+            'commonType': dfe['Type of Assistance (CLASS)'].mode()[0],
+            'commonMethod': paymentMethods.mode()[0],
+            'totalByType': dfe.groupby('Type of Assistance (CLASS)', observed = True)[' Amount '].sum()
+        }
+    results = cachedResult("Executive Summary", lastYear, summary)
 
     # Ensuring all of the elemnts here are dynamic and based on the data held within this page
-    st.write(f"— The Hope Foundation gave grants to {dfe['Patient ID#'].nunique()} individuals in {lastYear} across dozens of demographics")
+    st.write(f"— The Hope Foundation gave grants to {results['individuals']} individuals in {lastYear} across dozens of demographics")
 
-    st.write(f"— A total of ${dfe[' Amount '].sum().round(2)} was given out across {dfe[' Amount '].count()} grants")
+    st.write(f"— A total of ${results['total']} was given out across {results['grants']} grants")
     
     # I'm aware that Housing is not dynamic here. While it's unlikely anything will overtake Housing, I could not figure out a way to list the Type of Assistance with the highest sum paid out
-    st.write(f"— The most common type of assistance request was {dfe['Type of Assistance (CLASS)'].mode()[0]}, while the majority of grant funding went to Housing")
-    st.write(f"— The most common payment method was via {dfe['Payment Method'].mode()[0]}")
+    st.write(f"— The most common type of assistance request was {results['commonType']}, while the majority of grant funding went to Housing")
+    st.write(f"— The most common payment method was via {results['commonMethod']}")
 
     # Bit of a rehash with this info
     st.subheader(f"Total Grant Allocation by Type of Assistance in {lastYear}")
-    st.bar_chart(dfe.groupby('Type of Assistance (CLASS)')[' Amount '].sum())
+    st.bar_chart(results['totalByType'])
 
     
 
+# Trends over time.  Everything on this page comes out of the rollup main.py keeps (see trends.py), which is a
+# handful of rows per month, so it draws just as fast with ten years of requests behind it as with one.  Only the
+# months being looked at get their medians and rates worked out
+trendWindows = {"Month by month": 1, "Rolling 3 months": 3, "Rolling 12 months": 12}
+trendSpans = {"Last 12 months": 12, "Last 3 years": 36, "Last 5 years": 60, "Everything": None}
+
+def trendsOverTime():
+    st.title("Trends Over Time")
+    store = trendStore()
+
+    typeCol, windowCol, spanCol = st.columns([3, 2, 2])
+    assistance = typeCol.selectbox("Type of Assistance", trend_types(store))
+    window = trendWindows[windowCol.selectbox("Grouping", trendWindows)]
+    span = trendSpans[spanCol.selectbox("Showing", trendSpans, index = 1)]
+
+    def trendRows():
+        table = trend_table(store, assistance, window)
+        if span is not None and not table.empty:
+            table = table.loc[table.index > table.index.max() - pd.DateOffset(months = span)] # Counting back from the latest month with requests
+        return table
+    table = cachedResult("Trends", (assistance, window, span), trendRows)
+    if table.empty:
+        st.write("No requests of this type yet.")
+        return
+
+    if window > 1:
+        st.write(f"Every point is the {window} months up to and including that month.")
+    st.header("Requests")
+    st.line_chart(table['Requests'])
+    st.header("Amount paid")
+    st.line_chart(table['Amount Paid'])
+    st.header("Approval rate")
+    st.write("Out of the requests that have been approved or denied, so pending ones don't drag it down.")
+    st.line_chart(table['Approval Rate'])
+    st.header("Median days from request to payment")
+    st.line_chart(table['Median Days to Payment'])
+
+
 # Got the basics of this from a YouTube video by a channel called Tech with Tim.  Really interesting and clever format for arranging pages as functions
 
 pageToFunc = {
@@ -179,9 +582,26 @@ pageToFunc = {
     "Support Given": supportGiven,
     "Waiting Time": supportWait,
     "Grant Usage": grantBreakdown,
-    "Executive Summary": execSummary
+    "Executive Summary": execSummary,
+    "Trends": trendsOverTime
+}
+
+# The columns each page actually touches.  None means the page shows full tables, so it gets every
+# column that isn't just there for data preservation
+pageColumns = {
+    "Application Status": None,
+    "Support Given": [], # Reads the cube instead
+    "Waiting Time": ['days_request_to_payment'],
+    "Grant Usage": None,
+    "Executive Summary": ['grant_year', ' Amount ', 'Patient ID#', 'Type of Assistance (CLASS)', 'Payment Method'],
+    "Trends": [] # Reads the rollup instead
 }
 
 selectedPage = st.sidebar.selectbox("Menu", options = pageToFunc.keys())
 
+dataset = currentDataset() # The version this whole rerun uses, whatever the watcher swaps in meanwhile
+st.sidebar.caption(f"Data version {dataset['version'][:12]}, in use since {dataset['loaded']:%Y-%m-%d %H:%M:%S}")
+
+df = loadData(pageColumns[selectedPage])
 pageToFunc[selectedPage]()
+resultCachePanel()
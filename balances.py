@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from datastore import CLEANED_BALANCES
+
+# Grant Usage wants to know who ended a grant year with money left on their grant.  That's not the same as
+# anyone with a Remaining Balance above zero somewhere, since most grants have a balance on every request
+# but the last.  So for every requestor and grant year this keeps just the final request (by Grant Req Date,
+# ties going to whichever comes later in the sheet) and its balance, and flags it unused if that's above zero.
+#
+# It's all one lexsort and a comparison against the next row, so it costs about the same for a hundred
+# patients as for a hundred thousand.  Requests missing the patient, the date or the balance can't be placed
+# (or don't say anything), so they're left out.
+
+patient_column = 'Patient ID#'
+year_column = 'grant_year'
+date_column = 'Grant Req Date'
+balance_column = ' Remaining Balance '
+
+# The columns build_balances() needs from the cleaned data
+balance_source_columns = [patient_column, year_column, date_column, balance_column]
+
+balance_table_columns = [patient_column, year_column, date_column, balance_column, 'unused']
+
+
+def last_per_group(df):
+    # df's rows in sheet order.  np.lexsort sorts by its last key first and is stable, so rows that tie on all
+    # three keep their sheet order and the later one ends up last in its group
+    patients = df[patient_column].to_numpy(dtype = np.int64)
+    years = df[year_column].to_numpy(dtype = np.int64)
+    order = np.lexsort((df[date_column].to_numpy(dtype = 'datetime64[ns]').view(np.int64), years, patients))
+    patients, years = patients[order], years[order]
+    last = np.ones(len(order), dtype = bool)
+    last[:-1] = (patients[1:] != patients[:-1]) | (years[1:] != years[:-1])
+    return df.iloc[order[last]]
+
+def build_balances(df):
+    known = df[balance_source_columns].dropna()
+    table = last_per_group(known).reset_index(drop = True)
+    table = table.astype({patient_column: 'Int64', year_column: 'int64'})
+    return table.assign(unused = table[balance_column] > 0)[balance_table_columns]
+
+def merge_balances(table, addition):
+    # addition is the table for rows that come after table's in the sheet (the next chunk of a streaming run),
+    # so on a tie it's addition's request that's the later one.  Concatenating in that order is all it takes
+    return last_per_group(pd.concat([table, addition], ignore_index = True)).reset_index(drop = True)
+
+def update_balances(table, df, added):
+    # For an incremental run: only the requestor-years that picked up a new request can have a different final
+    # one, so just those are worked out again, from every one of their rows
+    touched = df.loc[added, [patient_column, year_column]].dropna().drop_duplicates()
+    if touched.empty:
+        return table
+    keys = pd.MultiIndex.from_frame(touched.astype('int64'))
+    rows = pd.MultiIndex.from_frame(df[[patient_column, year_column]].fillna(-1).astype('int64')).isin(keys)
+    kept = ~pd.MultiIndex.from_frame(table[[patient_column, year_column]].astype('int64')).isin(keys)
+    updated = pd.concat([table.loc[kept], build_balances(df.loc[rows])], ignore_index = True)
+    return updated.sort_values([patient_column, year_column], kind = 'stable', ignore_index = True)
+
+def unused_grants(table):
+    # Just the requestor-years that finished with money left over
+    return table.loc[table['unused']].reset_index(drop = True)
+
+
+# Saved as json, the same way as the cube, so it's readable without pyarrow.  Dates are ISO text
+
+def write_balances(table, version = None, balances_path = CLEANED_BALANCES):
+    with open(balances_path, 'w', encoding = 'utf-8') as file:
+        json.dump({
+            'version': version,
+            'columns': {
+                patient_column: table[patient_column].astype(int).tolist(),
+                year_column: table[year_column].astype(int).tolist(),
+                date_column: table[date_column].dt.strftime('%Y-%m-%d').tolist(),
+                balance_column: table[balance_column].astype(float).tolist(),
+            }
+        }, file)
+
+def read_balances(balances_path = CLEANED_BALANCES):
+    with open(balances_path, encoding = 'utf-8') as file:
+        saved = json.load(file)
+    columns = saved['columns']
+    table = pd.DataFrame({
+        patient_column: pd.Series(columns[patient_column], dtype = 'Int64'),
+        year_column: pd.Series(columns[year_column], dtype = 'int64'),
+        date_column: pd.to_datetime(pd.Series(columns[date_column], dtype = object), format = '%Y-%m-%d'),
+        balance_column: pd.Series(columns[balance_column], dtype = float),
+    })
+    return saved['version'], table.assign(unused = table[balance_column] > 0)[balance_table_columns]
@@ -0,0 +1,481 @@
+import argparse
+import contextlib
+import functools
+import importlib
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import main
+from excel import format_value
+from cube import build_cube, write_cube
+from balances import build_balances, write_balances
+from trends import build_trends, merge_trends, write_trends
+from validation import validate
+from datastore import CLEANED_CSV, CLEANED_FEATHER, CLEANED_SCHEMA, CLEANED_CUBE, CLEANED_BALANCES, CLEANED_TRENDS, write_cleaned
+
+# Benchmarks for main.py and the dashboard, run against made-up data sets much bigger than the real one.
+#
+#   python benchmark.py generate --sizes 10k 100k 1M 10M     (just make the synthetic files)
+#   python benchmark.py run --sizes 10k 100k                 (make whatever's missing, then time everything)
+#   python benchmark.py run --compare old_results.json       (and flag anything that got slower)
+#   python benchmark.py run --sizes 100k --xlsx              (also time reading the same rows from a workbook)
+#
+# Besides the cleaning and the dashboard's pages, each size gets startup timings: a fresh Python importing main,
+# python -m main --help, and (if streamlit is installed) the dashboard's first run, all in their own process so
+# nothing is already imported.  Those are what anyone waits through before the first thing happens.
+#
+# The synthetic files are built from Data Set.csv itself.  Every column is sampled on its own from the values
+# that really show up in it, in the proportions they show up, so the mess comes along for free: 'MAle',
+# ' $(1,234.00) ', ' Missing ', Payment Submitted? cells that are sometimes a date and sometimes 'yes', and so
+# on.  Sampling alone would mean a 10 million row file still only has the real file's couple thousand
+# spellings, though, so dates get nudged by up to half a year, dollar amounts get scaled a little and patient
+# IDs are drawn from a pool that grows with the file.  That keeps the number of distinct values growing the
+# way it would with real data.
+
+benchmark_dir = "benchmark_data"
+results_file = "benchmark_results.json"
+default_sizes = ['10k', '100k']
+generate_chunk = 100_000 # Rows generated (and held in memory) at a time
+
+date_shape = r'^(\s*)(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})(\s*)$'
+money_shape = r'^(\s*)\$\s*(\(?)([\d,]+\.\d{2})\)?(\s*)$'
+
+
+def parse_size(size):
+    # '10k' -> 10000, '1M' -> 1000000, plain numbers are left alone
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    size = size.strip().lower()
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+def synthetic_path(size):
+    return os.path.join(benchmark_dir, f"Data Set {size}.csv")
+
+def size_dir(size):
+    return os.path.join(benchmark_dir, size)
+
+def workbook_path(size):
+    return os.path.join(benchmark_dir, f"Data Set {size}.xlsx")
+
+
+# Generator
+
+def learn_profile(raw):
+    # Each column's distinct raw values (blanks included) and how often each one shows up
+    profile = {}
+    for column in raw.columns:
+        counts = raw[column].value_counts(dropna = False, normalize = True)
+        profile[column] = (counts.index.to_numpy(dtype = object), counts.to_numpy() / counts.sum())
+    return profile
+
+def vary_dates(cells, rng):
+    # Moves every m/d/yy or m/d/yyyy cell by up to 180 days, written back the same way it was written
+    parts = cells.str.extract(date_shape)
+    found = parts[1].notna()
+    if not found.any():
+        return cells
+    parts = parts[found]
+    short = parts[3].str.len() == 2
+    year = parts[3].astype(int)
+    year = year.where(~short, np.where(year < 50, 2000 + year, 1900 + year))
+    dates = pd.to_datetime(pd.DataFrame({'year': year, 'month': parts[1].astype(int), 'day': parts[2].astype(int)}), errors = 'coerce')
+    dates = dates + pd.to_timedelta(rng.integers(-180, 181, len(dates)), unit = 'D')
+    valid = dates.notna()
+    parts, short, dates = parts[valid], short[valid], dates[valid]
+
+    years = dates.dt.year.astype(str).where(~short, (dates.dt.year % 100).astype(str).str.zfill(2))
+    cells.loc[parts.index] = parts[0] + dates.dt.month.astype(str) + '/' + dates.dt.day.astype(str) + '/' + years + parts[4]
+    return cells
+
+def vary_money(cells, rng):
+    # Scales every ' $1,234.00 ' style amount, keeping the padding and accounting-style parentheses
+    parts = cells.str.extract(money_shape)
+    found = parts[2].notna()
+    if not found.any():
+        return cells
+    parts = parts[found]
+    amounts = parts[2].str.replace(',', '').astype(float) * rng.lognormal(0, 0.25, len(parts))
+    formatted = [f"{amount:,.2f}" for amount in amounts.round(0)]
+    opened = parts[1] == '('
+    cells.loc[parts.index] = parts[0] + '$' + opened.map({True: '(', False: ''}) + formatted + opened.map({True: ')', False: ''}) + parts[3]
+    return cells
+
+def synthesize(profile, rows, rng, patients):
+    chunk = {}
+    for column, (values, weights) in profile.items():
+        cells = pd.Series(rng.choice(values, size = rows, p = weights), dtype = object)
+        if cells.notna().any():
+            cells = vary_money(vary_dates(cells, rng), rng)
+        chunk[column] = cells
+    # The real file has roughly two requests per patient, so the pool of IDs scales with the whole file
+    chunk['Patient ID#'] = pd.Series((100000 + rng.integers(0, patients, rows)).astype(str), dtype = object)
+    return pd.DataFrame(chunk)
+
+def generate(size, seed = 0, source = main.dataset):
+    rows = parse_size(size)
+    raw = main.read_raw(source)
+    profile = learn_profile(raw)
+    patients = max(1, round(rows * raw['Patient ID#'].nunique() / len(raw)))
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(benchmark_dir, exist_ok = True)
+    path = synthetic_path(size)
+    with open(path + '.partial', 'w', encoding = 'utf-8', newline = '') as file:
+        for start in range(0, rows, generate_chunk):
+            chunk = synthesize(profile, min(generate_chunk, rows - start), rng, patients)
+            chunk.to_csv(file, header = start == 0, index = False)
+    os.replace(path + '.partial', path)
+    return path
+
+
+# Workbooks.  The synthetic csv saved back as an .xlsx, with cells stored the way Excel would have them (whole
+# numbers as numbers, m/d/yy dates as dates, dollar amounts as numbers with the sheet's accounting format) so
+# reading it back has the same formatting work to do as the real one.  A cell only gets a type if excel.py
+# renders it back to exactly the text it started as; anything else stays text
+
+accounting_format = '_([$$-409]* #,##0.00_);_([$$-409]* \\(#,##0.00\\);_([$$-409]* "-"??_);_(@_)'
+short_date = r'^(\d{1,2})/(\d{1,2})/(\d{2})$'
+
+def typed_cell(text):
+    # (value, number format) for one csv cell
+    if text is None:
+        return None, 'General'
+    candidates = []
+    if re.fullmatch(r'-?\d{1,15}', text):
+        candidates.append((int(text), 'General'))
+    date = re.fullmatch(short_date, text)
+    if date:
+        try:
+            candidates.append((datetime(2000 + int(date[3]) if int(date[3]) < 30 else 1900 + int(date[3]), int(date[1]), int(date[2])), 'mm-dd-yy'))
+        except ValueError:
+            pass
+    money = re.fullmatch(money_shape, text)
+    if money:
+        amount = float(money[3].replace(',', ''))
+        candidates.append((-amount if money[2] else amount, accounting_format))
+    for value, number_format in candidates:
+        if format_value(value, number_format) == text:
+            return value, number_format
+    return text, 'General'
+
+def write_workbook(size):
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+
+    workbook = openpyxl.Workbook(write_only = True)
+    sheet = workbook.create_sheet('PA Log Sheet')
+    for chunk_number, chunk in enumerate(pd.read_csv(synthetic_path(size), dtype = str, keep_default_na = False, chunksize = generate_chunk)):
+        if chunk_number == 0:
+            sheet.append(list(chunk.columns))
+        for row in chunk.itertuples(index = False):
+            cells = []
+            for text in row:
+                value, number_format = typed_cell(text or None)
+                cell = WriteOnlyCell(sheet, value = value)
+                cell.number_format = number_format
+                cells.append(cell)
+            sheet.append(cells)
+    path = workbook_path(size)
+    workbook.save(path + '.partial')
+    os.replace(path + '.partial', path)
+    return path
+
+
+# Timing
+
+def timed(function, repeat, setup = None):
+    # Runs function repeat times and keeps the best and median wall time.  setup (if given) runs before each
+    # call, isn't timed, and its result is what function gets called with
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = function(argument) if setup is not None else function()
+        times.append(time.perf_counter() - start)
+    return result, {'best': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+def bench_cleaning(size, repeat, workers, xlsx = False):
+    timings = {}
+    raw, timings['read_raw'] = timed(lambda: main.read_raw(synthetic_path(size)), repeat)
+    if xlsx:
+        # The same rows straight out of a workbook, which should come back identical to the csv
+        if not os.path.exists(workbook_path(size)):
+            write_workbook(size)
+        from_workbook, timings['read_raw (xlsx)'] = timed(lambda: main.read_raw(workbook_path(size)), repeat)
+        if not from_workbook.equals(raw):
+            print(f"  warning: {workbook_path(size)} doesn't read back the same as {synthetic_path(size)}")
+
+    # Every column on its own, starting from an empty spelling cache each time
+    cleaned = {}
+    for column, cleaner in main.column_cleaners.items():
+        if column not in raw and cleaner.source is None:
+            continue
+        values = tuple(cleaned[source] for source in cleaner.source) if cleaner.cleaned else raw[cleaner.source or column]
+        (cleaned[column], _), timings[f'clean_column: {column}'] = timed(lambda: main.clean_column(column, values, {}), repeat)
+
+    assembled, timings['assemble_cleaned'] = timed(lambda: main.assemble_cleaned(raw, cleaned), repeat)
+    (validated, _), timings['validate'] = timed(lambda: validate(assembled, raw, main.validation_rules, main.derived_columns), repeat)
+    filled, timings['fill_distances'] = timed(lambda: main.fill_distances(validated), repeat)
+    df, timings['cast_cleaned'] = timed(lambda: main.cast_cleaned(filled), repeat)
+
+    # And the whole thing end to end, with and without a warm spelling cache (the normal case after the first run)
+    mappings = {}
+    main.clean_data(raw.copy(), mappings)
+    _, timings['clean_data (cold mappings)'] = timed(lambda frame: main.clean_data(frame), repeat, setup = raw.copy)
+    _, timings['clean_data (warm mappings)'] = timed(lambda frame: main.clean_data(frame, mappings), repeat, setup = raw.copy)
+    if workers > 1:
+        _, timings[f'clean_data ({workers} workers)'] = timed(lambda frame: main.clean_data(frame, {}, workers), repeat, setup = raw.copy)
+
+    # Written where the dashboard benchmark will find it
+    out = size_dir(size)
+    os.makedirs(out, exist_ok = True)
+    paths = [os.path.join(out, name) for name in [CLEANED_CSV, CLEANED_FEATHER, CLEANED_SCHEMA]]
+    schema, timings['write_cleaned'] = timed(lambda: write_cleaned(df, *paths), repeat)
+    cube, timings['build_cube'] = timed(lambda: build_cube(df), repeat)
+    write_cube({**cube, 'version': schema['version']}, os.path.join(out, CLEANED_CUBE))
+    balances, timings['build_balances'] = timed(lambda: build_balances(df), repeat)
+    write_balances(balances, schema['version'], os.path.join(out, CLEANED_BALANCES))
+    trends, timings['build_trends'] = timed(lambda: build_trends(df), repeat)
+    write_trends({**trends, 'version': schema['version']}, os.path.join(out, CLEANED_TRENDS))
+    # What an incremental run does when the last 1% of the rows are new
+    split = len(df) - max(1, len(df) // 100)
+    _, timings['merge_trends (last 1% of rows)'] = timed(lambda parts: merge_trends(*parts), repeat,
+                                                         setup = lambda: (build_trends(df.iloc[:split]), build_trends(df.iloc[split:])))
+    return timings
+
+
+# The dashboard is a Streamlit script, so it can't just be imported and called.  This stands in for the
+# streamlit module: every display call does nothing, cache_resource really caches (so loadData behaves the way
+# it does in a live session), and selectbox answers with whatever choices says, or the first option otherwise.
+# It also remembers the options each selectbox was offered, which is how the benchmark finds every demographic.
+# The paged tables' other widgets just answer with their defaults (the first page, the default columns).
+class StreamlitStub(types.ModuleType):
+    def __init__(self):
+        super().__init__('streamlit')
+        self.choices = {}
+        self.options = {}
+        self.sidebar = self
+        self.session_state = {}
+
+    def cache_resource(self, function):
+        return functools.cache(function)
+
+    def selectbox(self, label, options, *args, **kwargs):
+        self.options[label] = list(options)
+        return self.choices.get(label, self.options[label][0])
+
+    def checkbox(self, *args, **kwargs):
+        return False
+
+    def multiselect(self, label, options, default = None, *args, **kwargs):
+        return list(default or [])
+
+    def radio(self, label, options, *args, **kwargs):
+        return list(options)[0]
+
+    def number_input(self, label, min_value = None, *args, **kwargs):
+        return min_value
+
+    def columns(self, spec, *args, **kwargs):
+        return [self] * (spec if isinstance(spec, int) else len(spec))
+
+    def form(self, *args, **kwargs):
+        return contextlib.nullcontext()
+
+    def expander(self, *args, **kwargs):
+        return contextlib.nullcontext()
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+@contextlib.contextmanager
+def stubbed_dashboard(directory):
+    # Dashboard.py (and datastore) look for the cleaned files in the working directory
+    stub = StreamlitStub()
+    previous = sys.modules.get('streamlit')
+    home = os.getcwd()
+    sys.path.insert(0, home)
+    sys.modules['streamlit'] = stub
+    sys.modules.pop('Dashboard', None)
+    os.chdir(directory)
+    try:
+        yield importlib.import_module('Dashboard'), stub
+    finally:
+        os.chdir(home)
+        sys.path.remove(home)
+        sys.modules.pop('Dashboard', None)
+        if previous is None:
+            sys.modules.pop('streamlit', None)
+        else:
+            sys.modules['streamlit'] = previous
+
+def bench_dashboard(size, repeat):
+    timings = {}
+    with stubbed_dashboard(size_dir(size)) as (dashboard, stub):
+        cache = dashboard.datasetCache()
+
+        def cold():
+            cache['entry'] = None
+
+        def opened(columns):
+            # What the top of a rerun does: pick up the current version (opening it, when cold), then load
+            dashboard.dataset = dashboard.currentDataset()
+            return dashboard.loadData(columns)
+
+        def fresh_frame(columns):
+            # Pages scribble on df, so every timed call gets a fresh one.  The page results are dropped too, so these
+            # timings are the page doing its work (the cached timings below are a repeat view of the same choices)
+            def setup():
+                results = dashboard.resultCache()
+                results['entries'].clear()
+                results['bytes'] = 0
+                dashboard.df = dashboard.loadData(columns)
+            return setup
+
+        def cached_frame(columns):
+            return lambda: setattr(dashboard, 'df', dashboard.loadData(columns))
+
+        for page, function in dashboard.pageToFunc.items():
+            columns = dashboard.pageColumns[page]
+            _, timings[f'{page}: loadData (cold)'] = timed(lambda _: opened(columns), repeat, setup = cold)
+            _, timings[f'{page}: loadData (cached)'] = timed(lambda: dashboard.loadData(columns), repeat)
+
+            if page == "Support Given":
+                # One timing per demographic, since each one is its own pair of groupbys
+                fresh_frame(columns)()
+                function()
+                for demographic in stub.options["Select Demographic"]:
+                    stub.choices["Select Demographic"] = demographic
+                    _, timings[f'{page}: {demographic}'] = timed(lambda _: function(), repeat, setup = fresh_frame(columns))
+                    _, timings[f'{page}: {demographic} (cached result)'] = timed(lambda _: function(), repeat, setup = cached_frame(columns))
+                stub.choices.pop("Select Demographic")
+            else:
+                _, timings[page] = timed(lambda _: function(), repeat, setup = fresh_frame(columns))
+                _, timings[f'{page} (cached result)'] = timed(lambda _: function(), repeat, setup = cached_frame(columns))
+    return timings
+
+
+def bench_startup(size, repeat):
+    # Each in a brand new interpreter, so every import is paid for again.  The dashboard is run with streamlit's
+    # own test harness, headless, against this size's cleaned files
+    here = os.path.dirname(os.path.abspath(__file__))
+    environment = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')]))}
+    def started(*arguments):
+        return lambda: subprocess.run([sys.executable, *arguments], cwd = size_dir(size), env = environment,
+                                      stdout = subprocess.DEVNULL, check = True)
+
+    timings = {}
+    _, timings['python (nothing imported)'] = timed(started('-c', 'pass'), repeat)
+    _, timings['import main'] = timed(started('-c', 'import main'), repeat)
+    _, timings['python -m main --help'] = timed(started('-m', 'main', '--help'), repeat)
+    try:
+        import streamlit.testing.v1 # Only checking it's there, the timing imports it again in its own process
+    except ImportError:
+        return timings
+    dashboard = os.path.join(here, 'Dashboard.py')
+    script = f"from streamlit.testing.v1 import AppTest; AppTest.from_file({dashboard!r}, default_timeout = 600).run()"
+    _, timings['Dashboard first run'] = timed(started('-c', script), repeat)
+    return timings
+
+
+def run(sizes, repeat, workers, regenerate = False, seed = 0, xlsx = False):
+    results = {
+        'started': datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'sizes': {}
+    }
+    for size in sizes:
+        print(f"{size}: generating" if regenerate or not os.path.exists(synthetic_path(size)) else f"{size}: using {synthetic_path(size)}")
+        entry = {'rows': parse_size(size), 'timings': {}}
+        if regenerate or not os.path.exists(synthetic_path(size)):
+            _, entry['generate'] = timed(lambda: generate(size, seed), 1)
+            if os.path.exists(workbook_path(size)):
+                os.remove(workbook_path(size)) # Made from the old csv
+
+        for group, timings in [('cleaning', bench_cleaning(size, repeat, workers, xlsx)), ('dashboard', bench_dashboard(size, repeat)),
+                               ('startup', bench_startup(size, repeat))]:
+            for name, timing in timings.items():
+                entry['timings'][f'{group}: {name}'] = timing
+                print(f"  {group}: {name:<60} {timing['best']:9.4f}s")
+        results['sizes'][size] = entry
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Something counts as a regression when its best time is more than tolerance slower than the baseline's,
+    # and by more than 5ms, so tiny timings jittering around don't cry wolf
+    regressions = []
+    for size, entry in results['sizes'].items():
+        previous = baseline.get('sizes', {}).get(size)
+        if previous is None:
+            continue
+        for name, timing in entry['timings'].items():
+            old = previous['timings'].get(name)
+            if old is None:
+                continue
+            ratio = timing['best'] / old['best'] if old['best'] else float('inf')
+            if ratio > 1 + tolerance and timing['best'] - old['best'] > 0.005:
+                regressions.append((size, name, old['best'], timing['best'], ratio))
+
+    for size, name, old, new, ratio in regressions:
+        print(f"REGRESSION {size} {name}: {old:.4f}s -> {new:.4f}s ({ratio:.2f}x)")
+    if not regressions:
+        print("No regressions against the baseline")
+    return regressions
+
+
+def benchmark(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark main.py and the dashboard on synthetic data")
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    generate_parser = commands.add_parser('generate', help = "only write the synthetic data sets")
+    run_parser = commands.add_parser('run', help = "generate anything missing, then time the cleaning and the dashboard")
+    for command in [generate_parser, run_parser]:
+        command.add_argument('--sizes', nargs = '+', default = default_sizes, metavar = 'SIZE',
+                             help = "row counts to use, e.g. 10k 100k 1M 10M (default: %(default)s)")
+        command.add_argument('--seed', type = int, default = 0)
+    run_parser.add_argument('--repeat', type = int, default = 3, help = "times to run each step, best is kept (default 3)")
+    run_parser.add_argument('--workers', type = int, default = 1, help = "also time clean_data() with this many processes")
+    run_parser.add_argument('--xlsx', action = 'store_true',
+                            help = "also time reading each size from an .xlsx workbook (written the first time, which takes a while)")
+    run_parser.add_argument('--regenerate', action = 'store_true', help = "rebuild the synthetic files even if they exist")
+    run_parser.add_argument('--results', default = results_file, help = "where to write the results (default: %(default)s)")
+    run_parser.add_argument('--compare', metavar = 'BASELINE', help = "an earlier results file to check for regressions against")
+    run_parser.add_argument('--tolerance', type = float, default = 0.2, help = "allowed slowdown before it counts (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        for size in args.sizes:
+            print(f"Wrote {generate(size, args.seed)}")
+        return 0
+
+    results = run(args.sizes, args.repeat, args.workers, args.regenerate, args.seed, args.xlsx)
+    with open(args.results, 'w', encoding = 'utf-8') as file:
+        json.dump(results, file, indent = 2)
+    print(f"Results written to {args.results}")
+
+    if args.compare:
+        with open(args.compare, encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        return 1 if compare(results, baseline, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(benchmark())
@@ -0,0 +1,231 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from matching import canonicalize
+
+# The building blocks main.py's cleaning table is made of.
+#
+# main.py used to clean each column with a long run of .str.title(), .str.strip() and .replace() calls, and
+# every single one of those walked the entire column again (Payment Method alone took 13 trips).  Here each
+# column's rules are written down once, in order, and compiled into a single function that takes one raw
+# value all the way to its clean version, so every column is walked exactly once no matter how many rules
+# it has.  The typed cleaners at the bottom (category, flag, money, number, zip_code, date) wrap those
+# rules with whatever conversion the column needs at the end.
+#
+# The rules behave the way the pandas calls they replaced did: a regex swapped in for a string value works
+# like re.sub, while a regex swapped in for anything else (np.nan, True, False) replaces the whole value
+# whenever the pattern is found anywhere in it.
+
+
+# Text steps.  Anything that isn't text (blanks, or a True/False an earlier rule already decided on) is
+# passed along untouched.
+
+def title(value):
+    return value.title() if isinstance(value, str) else value
+
+def upper(value):
+    return value.upper() if isinstance(value, str) else value
+
+def strip(value):
+    return value.strip() if isinstance(value, str) else value
+
+def translate(table):
+    table = str.maketrans(table)
+    def step(value):
+        return value.translate(table) if isinstance(value, str) else value
+    return step
+
+def replace(mapping):
+    # Exact matches only, same as .replace('Missing', np.nan) and friends
+    def step(value):
+        return mapping.get(value, value) if isinstance(value, str) else value
+    return step
+
+def regex(pattern, new_value):
+    pattern = re.compile(pattern)
+    if isinstance(new_value, str):
+        def step(value):
+            return pattern.sub(new_value, value) if isinstance(value, str) else value
+    else:
+        def step(value):
+            return new_value if isinstance(value, str) and pattern.search(value) is not None else value
+    return step
+
+def contains(text, new_value):
+    def step(value):
+        return new_value if isinstance(value, str) and text in value else value
+    return step
+
+def first(characters):
+    def step(value):
+        return value[:characters] if isinstance(value, str) else value
+    return step
+
+def compile_steps(steps):
+    def clean_value(value):
+        for step in steps:
+            value = step(value)
+        return value
+    return clean_value
+
+
+# Column cleaners.  Each one takes the raw column and hands back the finished one.  source is the column it
+# reads when that isn't the column it writes (Payment Submitted? Boolean is built from Payment Submitted?),
+# and cleaned means it's worked out from the cleaned versions of the columns in source instead (YOB needs the
+# parsed DOB).  For those, source is always a tuple of column names, and the cleaner gets one Series for each.
+# mapped cleaners are the ones built from text rules, and they also take known, a dict of raw spelling ->
+# cleaned value that they read from and add to (main.py keeps it on disk between runs).  Cleaners with learn
+# answer for a spelling depending on what other spellings come with it, so they're best shown every spelling
+# in the column at once: learn(spellings, counts, known) takes the distinct raw spellings and how many rows
+# have each, and saves what it picked in known for the cleaner to look up afterwards.
+
+class ColumnCleaner:
+    def __init__(self, convert, source = None, cleaned = False, mapped = False, learn = None):
+        self.convert = convert
+        self.source = source
+        self.cleaned = cleaned
+        self.mapped = mapped
+        self.learn = learn
+
+    def __call__(self, values, known = None):
+        if self.mapped:
+            return self.convert(values, {} if known is None else known)
+        return self.convert(values)
+
+
+def apply_steps(values, steps, known):
+    # A column only has a handful of different spellings in it, however many rows there are.  factorize()
+    # splits it into one code per row plus the list of distinct spellings, the rules run once per spelling
+    # that isn't already in known, and the codes put the answers back in place.  Blanks come out as code -1,
+    # which conveniently picks the np.nan parked on the end of cleaned
+    codes, spellings = pd.factorize(values)
+    clean_value = compile_steps(steps)
+    cleaned = np.empty(len(spellings) + 1, dtype = object)
+    for position, spelling in enumerate(spellings):
+        if spelling not in known:
+            known[spelling] = clean_value(spelling)
+        cleaned[position] = known[spelling]
+    cleaned[-1] = np.nan
+    return pd.Series(cleaned[codes], index = values.index, dtype = object)
+
+def category(*steps, source = None):
+    return ColumnCleaner(lambda values, known: apply_steps(values, steps, known), source, mapped = True)
+
+def flag(*steps, source = None):
+    # Whatever the rules didn't settle as True or False ends up unknown
+    steps = steps + (lambda value: value if isinstance(value, bool) else np.nan,)
+    return ColumnCleaner(lambda values, known: apply_steps(values, steps, known).astype('boolean'), source, mapped = True)
+
+def canonical(*steps, people = False, overrides = None, source = None):
+    # Like category, and then spellings that are near enough the same clinic or person are folded into one name
+    # (see matching.py).  people says the values are people's names, whose credentials and titles don't count.
+    # overrides can be a function handing them back, so a file of them is only read once there's cleaning to do.
+    # known holds two dicts.  'spellings' is raw spelling -> what the rules clean it up to, which only ever
+    # depends on the spelling itself, the same as category's.  'names' is cleaned spelling -> the name it was
+    # folded into, the record of every name picked before, which new spellings are matched against first.
+    # Overrides aren't kept in names, so editing the override file always takes effect
+    clean_value = compile_steps(steps)
+    def fixed():
+        return (overrides() if callable(overrides) else overrides) or {}
+
+    def clean_spellings(spellings, known):
+        rules = known.setdefault('spellings', {})
+        for spelling in spellings:
+            if spelling not in rules:
+                rules[spelling] = clean_value(spelling)
+        return pd.Series([rules[spelling] for spelling in spellings], dtype = object)
+
+    def learn(spellings, counts, known):
+        cleaned = clean_spellings(spellings, known)
+        names = known.setdefault('names', {})
+        text = cleaned.map(lambda spelling: isinstance(spelling, str)).to_numpy(dtype = bool)
+        rows = pd.Series(np.asarray(counts)[text]).groupby(cleaned[text].to_numpy()).sum() # Raw spellings that clean up the same count together
+        rows = rows[~rows.index.isin(list(names))]
+        if len(rows):
+            corrections = fixed()
+            picked = canonicalize(list(rows.index), rows.to_numpy(), dict.fromkeys(names.values()), people, corrections)
+            names.update((spelling, name) for spelling, name in picked.items() if spelling not in corrections)
+
+    def convert(values, known):
+        codes, spellings = pd.factorize(values)
+        learn(spellings, np.bincount(codes[codes >= 0], minlength = len(spellings)), known)
+        corrections = fixed()
+        names = known['names']
+        answers = np.empty(len(spellings) + 1, dtype = object)
+        answers[:-1] = [corrections.get(spelling, names.get(spelling, np.nan)) if isinstance(spelling, str) else spelling
+                        for spelling in clean_spellings(spellings, known)]
+        answers[-1] = np.nan
+        return pd.Series(answers[codes], index = values.index, dtype = object)
+    return ColumnCleaner(convert, source, mapped = True, learn = learn)
+
+# Dollar signs, commas, spaces and accounting-style negatives, e.g. ' $(1,234.00) ' -> -1234.0.  The sheet
+# uses a lone '-' for $0, hence '-' -> '0'
+money_characters = {' ': '', '$': '', ',': '', '-': '0', '(': '-', ')': ''}
+
+def money(round_to = None, source = None):
+    steps = (translate(money_characters),)
+    def convert(values):
+        # Amounts are too varied to be worth remembering between runs, hence the throwaway known dict
+        amounts = pd.to_numeric(apply_steps(values, steps, {}), errors = 'coerce').astype(float)
+        return amounts if round_to is None else amounts.round(round_to)
+    return ColumnCleaner(convert, source)
+
+def number(round_to = None, dtype = 'float64', source = None):
+    # Anything that doesn't read as a number ('Missing', '?', a stray space) becomes a blank
+    def convert(values):
+        numbers = pd.to_numeric(values, errors = 'coerce')
+        numbers = numbers if round_to is None else numbers.round(round_to)
+        return numbers.astype(dtype)
+    return ColumnCleaner(convert, source)
+
+def zip_code(corrections = None, source = None):
+    steps = (translate({' ': ''}), replace(corrections or {}), first(5)) # Just the first five digits of the zip code
+    def convert(values):
+        return pd.to_numeric(apply_steps(values, steps, {}), errors = 'coerce').astype('Int64')
+    return ColumnCleaner(convert, source)
+
+def parse_dates(text, formats, mixed = False):
+    # Each distinct spelling is parsed once.  The formats are tried in order, each one over every spelling that
+    # hasn't been read yet, and since they're exact formats pandas can do each one in a single vectorized sweep.
+    # mixed hands whatever is left over to pandas' guess-each-one-separately parsing, which is far slower but
+    # takes just about anything
+    codes, spellings = pd.factorize(text)
+    spellings = pd.Series(spellings, dtype = object)
+    parsed = pd.Series(pd.NaT, index = spellings.index, dtype = 'datetime64[ns]')
+    left = spellings
+    for format in formats:
+        attempt = pd.to_datetime(left, format = format, errors = 'coerce')
+        parsed[attempt.index] = attempt
+        left = left[attempt.isna()]
+    if mixed and len(left):
+        parsed[left.index] = pd.to_datetime(left, format = 'mixed', errors = 'coerce')
+
+    dates = np.append(parsed.to_numpy(), np.datetime64('NaT', 'ns'))
+    return pd.Series(dates[codes], index = text.index)
+
+def date(*steps, formats, mixed = False, source = None):
+    def convert(values, known = None):
+        text = apply_steps(values, steps, known) if steps else values
+        return parse_dates(text, formats, mixed)
+    return ColumnCleaner(convert, source, mapped = bool(steps))
+
+
+# Columns worked out from other, already cleaned, columns
+
+def derived(function, *sources):
+    return ColumnCleaner(lambda values: function(*values), sources, cleaned = True)
+
+def year_of(source):
+    return derived(lambda dates: dates.dt.year.astype(float), source)
+
+def days_between(start, end):
+    return derived(lambda start, end: (end - start).dt.days.astype(float), start, end)
+
+def age_on(birth, on):
+    # Whole years, so someone is still 39 the day before their 40th birthday
+    def age(birth, on):
+        before_birthday = (on.dt.month < birth.dt.month) | ((on.dt.month == birth.dt.month) & (on.dt.day < birth.dt.day))
+        return (on.dt.year - birth.dt.year - before_birthday.astype(float)).astype(float)
+    return derived(age, birth, on)
@@ -0,0 +1,99 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from datastore import CLEANED_CUBE
+
+# The Support Given page shows the average and total grant for every value of one demographic.  Doing that
+# with a groupby over the whole data set on every click adds up, so main.py works the numbers out once, right
+# after cleaning, and saves them as a small "cube": for each demographic, one row per value with the number of
+# rows, how many of those had an Amount, and the sum, min and max of Amount.  Those four all add up across
+# batches of rows (min and max by taking the min and max), which is what lets an incremental run fold just the
+# new rows into the existing cube.  The mean isn't stored since it's just sum / count.
+#
+# Ages get grouped into bands here too, worked out from YOB against as_of_year.  A cube from last year has
+# everyone a year too young, so anything reading it should check as_of_year first.
+
+amount_column = ' Amount '
+
+# Every demographic the page offers, as the column it groups by.  'Age' isn't a column, it's the bands below
+cube_dimensions = ['Pt State', 'Gender', ' Total Household Gross Monthly Income ', 'Insurance Type', 'Age',
+                   'Type of Assistance (CLASS)', 'Hispanic/Latino', 'Sexual Orientation', 'Marital Status', 'Race',
+                   'Distance roundtrip/Tx']
+
+# The columns build_cube() needs from the cleaned data
+cube_source_columns = [amount_column, 'YOB', *[column for column in cube_dimensions if column != 'Age']]
+
+age_band_edges = [-np.inf, 20, 30, 40, 50, 60, 70, 80, np.inf]
+age_band_labels = ['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
+
+statistics = ['rows', 'count', 'sum', 'min', 'max']
+
+
+def age_bands(yob, as_of_year):
+    bands = pd.cut(as_of_year - yob, age_band_edges, right = False, labels = age_band_labels)
+    return bands.astype(object).where(bands.notna(), np.nan)
+
+def build_cube(df, as_of_year = None, version = None):
+    as_of_year = datetime.today().year if as_of_year is None else as_of_year
+    amounts = df[amount_column]
+    dimensions = {}
+    for dimension in cube_dimensions:
+        keys = age_bands(df['YOB'], as_of_year) if dimension == 'Age' else df[dimension]
+        if keys.dtype == 'float32':
+            # Read back as the number that was written (177.4, not 177.39999389648438), so the keys are the same
+            # as a cube loaded from json and the page's labels read properly
+            keys = keys.astype(str).astype(float)
+        grouped = amounts.groupby(keys.rename(dimension), dropna = True, observed = True)
+        table = pd.DataFrame({'rows': grouped.size(), 'count': grouped.count(), 'sum': grouped.sum().round(2),
+                              'min': grouped.min(), 'max': grouped.max()})
+        if isinstance(table.index, pd.CategoricalIndex): # Plain values, like a cube read back from json
+            table.index = table.index.astype(table.index.categories.dtype)
+        dimensions[dimension] = table
+    return {'version': version, 'as_of_year': as_of_year, 'dimensions': dimensions}
+
+def merge_cubes(cube, addition):
+    # Folds addition (a cube of some new rows) into cube.  Both have to be from the same as_of_year
+    dimensions = {}
+    for dimension, table in cube['dimensions'].items():
+        both = pd.concat([part for part in [table, addition['dimensions'][dimension]] if len(part)] or [table])
+        merged = both.groupby(level = 0).agg({'rows': 'sum', 'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+        dimensions[dimension] = merged.round({'sum': 2}) # To the cent, so adding up in a different order can't change it
+    return {**cube, 'dimensions': dimensions}
+
+def cube_table(cube, dimension):
+    # What the page actually draws: one row per value with count, sum, mean, min and max of Amount
+    table = cube['dimensions'][dimension]
+    table = table.assign(mean = table['sum'] / table['count'].where(table['count'] > 0))
+    return table[['count', 'sum', 'mean', 'min', 'max']]
+
+
+# Saved as json since it's small (a few hundred rows all told) and json keeps the keys' types: state names stay
+# text, True/False stay booleans and the income and distance values stay numbers.  Blanks are stored as null.
+
+def write_cube(cube, cube_path = CLEANED_CUBE):
+    dimensions = {}
+    for dimension, table in cube['dimensions'].items():
+        dimensions[dimension] = {'keys': [to_json(key) for key in table.index]}
+        for statistic in statistics:
+            dimensions[dimension][statistic] = [to_json(value) for value in table[statistic]]
+    with open(cube_path, 'w', encoding = 'utf-8') as file:
+        json.dump({'version': cube['version'], 'as_of_year': cube['as_of_year'], 'dimensions': dimensions}, file, indent = 1)
+
+def read_cube(cube_path = CLEANED_CUBE):
+    with open(cube_path, encoding = 'utf-8') as file:
+        saved = json.load(file)
+    dimensions = {}
+    for dimension, columns in saved['dimensions'].items():
+        table = pd.DataFrame({statistic: pd.Series(columns[statistic], dtype = float) for statistic in statistics})
+        table.index = pd.Index(columns['keys'], name = dimension)
+        dimensions[dimension] = table.astype({'rows': int, 'count': int})
+    return {'version': saved['version'], 'as_of_year': saved['as_of_year'], 'dimensions': dimensions}
+
+def to_json(value):
+    # numpy scalars to plain Python, and NaN to None
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# Everything that reads or writes the cleaned data set lives here so main.py (the writer) and Dashboard.py
+# (the reader) always agree on file names and column types.
+#
+# The csv is still written on every run because it's the friendliest thing to hand to anyone with Excel, but
+# it forgets every type main.py worked out.  The feather file keeps them, and it's written uncompressed on
+# purpose: that lets the dashboard memory-map it and pull out just the columns a page asks for instead of
+# parsing the whole thing.  The schema sidecar is a small json file describing every column, which is what
+# lets the csv be read back with the right types when the feather file (or pyarrow) isn't around.
+
+CLEANED_CSV = "Cleaned Data Set.csv"
+CLEANED_FEATHER = "Cleaned Data Set.feather"
+CLEANED_SCHEMA = "Cleaned Data Set.schema.json"
+CLEANED_CUBE = "Cleaned Data Set.cube.json" # Support Given's precomputed totals, see cube.py
+CLEANED_BALANCES = "Cleaned Data Set.balances.json" # Every requestor's final balance in each grant year, see balances.py
+CLEANED_QUARANTINE = "Cleaned Data Set.quarantine.csv" # Raw rows that broke a validation rule and why, see validation.py
+CLEANED_TRENDS = "Cleaned Data Set.trends.json" # Month by month totals for the Trends page, see trends.py
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_schema(dtypes, rows, index_name = None):
+    return {
+        'rows': rows,
+        'index': index_name,
+        'columns': [{'name': column, 'dtype': str(dtype)} for column, dtype in dtypes.items()]
+    }
+
+
+def read_schema(schema_path = CLEANED_SCHEMA):
+    with open(schema_path, encoding = 'utf-8') as file:
+        return json.load(file)
+
+
+def arrow_schema(dtypes):
+    # Built from the pandas types rather than from the data, so a chunk where some text column happens to be
+    # entirely blank still gets written as text.  Keeping the pandas metadata is what lets Int32, boolean and
+    # datetime columns come back as themselves when the file is read.  Categories are written as plain text:
+    # every chunk has its own set of them, and a feather file can't change a column's dictionary partway
+    # through.  restore_dtypes() turns them back into categories on the way in
+    import pyarrow as pa
+    template = pd.DataFrame({column: pd.Series(dtype = dtype) for column, dtype in dtypes.items()})
+    schema = pa.Schema.from_pandas(template, preserve_index = False)
+    for position, (column, dtype) in enumerate(dtypes.items()):
+        if str(dtype) in ['object', 'category']:
+            schema = schema.set(position, pa.field(column, pa.string()))
+    return schema
+
+def restore_dtypes(frame, schema):
+    # Everything the feather file can't bring back by itself (just categories, see arrow_schema())
+    dtypes = schema_dtypes(schema)
+    categories = [column for column in frame.columns if dtypes.get(column) == 'category']
+    return frame.astype({column: 'category' for column in categories}) if categories else frame
+
+
+# Writes the cleaned data one chunk at a time, so main.py never needs the whole cleaned frame in memory.
+# Everything goes to temporary '.partial' files first and is moved into place by close(), so a dashboard
+# never maps (or reads) a half-written file.  write_cleaned() is just this with a single chunk, which keeps
+# the streaming and in-memory runs producing the same data.  The csv comes out byte-for-byte the same either
+# way, but the feather file doesn't: every chunk is its own record batch in it.  So the schema's version (what
+# the cube, balances and trends are stamped with, and what the dashboard caches results under) is the csv's
+# hash, and the feather file's own hash is kept next to it as feather_hash, for telling whether the schema
+# belongs to the feather file that's on disk.
+class CleanedWriter:
+    def __init__(self, csv_path = CLEANED_CSV, feather_path = CLEANED_FEATHER, schema_path = CLEANED_SCHEMA):
+        self.csv_path = csv_path
+        self.feather_path = feather_path
+        self.schema_path = schema_path
+        self.dtypes = None
+        self.index_name = None
+        self.rows = 0
+        self.csv_file = None
+        self.feather_file = None
+        self.feather_writer = None
+        self.feather_schema = None
+
+    def start(self, chunk):
+        self.dtypes = chunk.dtypes.to_dict()
+        self.index_name = chunk.index.name
+        self.csv_file = open(self.csv_path + '.partial', 'w', encoding = 'utf-8', newline = '')
+        try:
+            import pyarrow as pa
+        except ImportError:
+            self.feather_path = None # No pyarrow, no feather file.  The csv and schema still get written
+        if self.feather_path is not None:
+            self.feather_file = pa.OSFile(self.feather_path + '.partial', 'wb')
+            # Feather is the Arrow IPC file format, and leaving compression off keeps it memory-mappable
+            self.feather_schema = arrow_schema(self.dtypes)
+            self.feather_writer = pa.ipc.new_file(self.feather_file, self.feather_schema)
+
+    def write(self, chunk):
+        if self.dtypes is None:
+            self.start(chunk)
+        chunk.to_csv(self.csv_file, header = self.rows == 0)
+        if self.feather_writer is not None:
+            import pyarrow as pa
+            self.feather_writer.write_table(pa.Table.from_pandas(chunk, schema = self.feather_schema, preserve_index = False))
+        self.rows += len(chunk)
+
+    def close(self):
+        self.csv_file.close()
+        os.replace(self.csv_path + '.partial', self.csv_path)
+        schema = build_schema(self.dtypes, self.rows, self.index_name)
+
+        schema['version'] = file_hash(self.csv_path)
+        if self.feather_writer is not None:
+            self.feather_writer.close()
+            self.feather_file.close()
+            os.replace(self.feather_path + '.partial', self.feather_path)
+            schema['feather_hash'] = file_hash(self.feather_path)
+
+        with open(self.schema_path, 'w', encoding = 'utf-8') as file:
+            json.dump(schema, file, indent = 2)
+        return schema
+
+
+def write_cleaned(df, csv_path = CLEANED_CSV, feather_path = CLEANED_FEATHER, schema_path = CLEANED_SCHEMA):
+    writer = CleanedWriter(csv_path, feather_path, schema_path)
+    writer.write(df)
+    return writer.close()
+
+
+def schema_dtypes(schema):
+    return {column['name']: column['dtype'] for column in schema['columns']}
+
+
+def open_feather(feather_path = CLEANED_FEATHER):
+    # Memory-mapped and uncompressed, so this only reads the file's footer.  Column data is paged in by the OS
+    # as it's converted, which is what keeps each dashboard worker from holding its own full copy
+    import pyarrow.feather as feather
+    return feather.read_table(feather_path, memory_map = True)
+
+
+def feather_columns(table, columns, schema = None):
+    # to_pandas() uses the pandas metadata stored alongside the table, so Int32, boolean and datetime
+    # columns come back exactly as main.py left them.  With the schema, categories do too
+    frame = table.select(list(columns)).to_pandas()
+    return frame if schema is None else restore_dtypes(frame, schema)
+
+
+def read_cleaned_csv(csv_path = CLEANED_CSV, schema = None, columns = None):
+    # The first csv column is always the index, and it has to come along no matter which columns are asked for
+    usecols = None
+    if columns is not None:
+        header = list(pd.read_csv(csv_path, nrows = 0).columns)
+        usecols = [0] + [position for position, name in enumerate(header) if name in set(columns)]
+
+    if schema is None:
+        return pd.read_csv(csv_path, index_col = 0, usecols = usecols)
+
+    dtypes = schema_dtypes(schema)
+    wanted = list(dtypes) if columns is None else list(columns)
+    date_columns = [column for column in wanted if dtypes[column].startswith('datetime64')]
+    read_types = {column: dtypes[column] for column in wanted if column not in date_columns}
+
+    frame = pd.read_csv(csv_path, index_col = 0, usecols = usecols, dtype = read_types)
+    frame.index.name = schema.get('index')
+    for column in date_columns:
+        frame[column] = pd.to_datetime(frame[column], format = 'ISO8601', errors = 'coerce')
+    return frame[wanted]
+
+
+def read_cleaned(columns = None, feather_path = CLEANED_FEATHER, csv_path = CLEANED_CSV, schema_path = CLEANED_SCHEMA):
+    # Whole-frame read for code that isn't the dashboard (main.py's incremental mode, mostly).  Prefers the
+    # feather file since it round-trips every type exactly
+    schema = read_schema(schema_path)
+    wanted = [column['name'] for column in schema['columns']] if columns is None else list(columns)
+    if os.path.exists(feather_path):
+        try:
+            return feather_columns(open_feather(feather_path), wanted, schema)
+        except ImportError:
+            pass
+    return read_cleaned_csv(csv_path, schema, wanted)
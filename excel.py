@@ -0,0 +1,283 @@
+import csv
+import datetime
+import functools
+import io
+import os
+import re
+
+import pandas as pd
+
+# Reads the foundation's workbook directly, so nobody has to open it in Excel and 'Save As' csv first.
+#
+# The cleaning in main.py is written against what that csv export looks like, and the csv export is whatever
+# Excel *shows* in each cell rather than what's stored there: 320 with an accounting format becomes
+# ' $320.00 ', a date becomes '10/17/18', a blank zero becomes ' $-   ' and text in a money column picks up
+# the same padding (' Missing ').  So every cell is run through its number format here to get the same text
+# back, and each batch of rows is then handed to read_csv exactly like the export would be, which keeps the
+# blanks, the 'N/A'-style missing values and the 'Unnamed: 30' headers identical too.  The result is the
+# same frame of strings read_raw() gets from the csv, row for row.
+#
+# openpyxl's read_only mode streams the rows out of the file as it goes instead of building the whole
+# workbook in memory first, and formulas (Remaining Balance is one) are read as the values Excel last saved.
+
+workbook_extensions = ('.xlsx', '.xlsm')
+batch_rows = 10_000 # Rows rendered and parsed at a time when no chunksize is asked for
+
+
+def is_workbook(path):
+    return os.path.splitext(path)[1].lower() in workbook_extensions
+
+def read_xlsx(path, chunksize = None, sheet = None):
+    # Like pd.read_csv(dtype = str): the whole sheet as one frame, or with chunksize an iterator of frames
+    # chunksize rows long with the index carrying on from one to the next.  sheet defaults to the first one
+    chunks = xlsx_chunks(path, chunksize or batch_rows, sheet)
+    if chunksize is not None:
+        return chunks
+    frames = list(chunks)
+    return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+def xlsx_chunks(path, chunksize, sheet = None):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("Reading .xlsx files needs openpyxl (pip install openpyxl), or export the sheet to csv instead")
+
+    workbook = openpyxl.load_workbook(path, read_only = True, data_only = True)
+    try:
+        worksheet = workbook.worksheets[0] if sheet is None else workbook[sheet]
+        rows = worksheet.iter_rows()
+        header = [cell_text(cell) for cell in next(rows, [])]
+        start = 0
+        batch = []
+        for row in rows:
+            batch.append(row_text(row, len(header)))
+            if len(batch) == chunksize:
+                yield parse_batch(header, batch, start)
+                start += len(batch)
+                batch = []
+        if batch or start == 0:
+            yield parse_batch(header, batch, start)
+    finally:
+        workbook.close()
+
+def row_text(row, width):
+    # read_only rows stop at their last filled cell, so short ones get padded out to the header
+    texts = [cell_text(cell) for cell in row[:width]]
+    return texts + [''] * (width - len(texts))
+
+def parse_batch(header, batch, start):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(batch)
+    buffer.seek(0)
+    frame = pd.read_csv(buffer, dtype = str)
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    return frame
+
+
+# Rendering a cell the way Excel displays it.  This covers the number formats spreadsheets like this one
+# actually use (General, fixed decimals, thousands separators, accounting and currency formats with their
+# positive;negative;zero;text sections, and dates), not every corner of Excel's format language.  A sheet only
+# has a handful of distinct formats, so each one is worked out once (compile_format) into the text that goes
+# around the value and how the value itself is written, and every cell after that is just filling it in.
+
+def cell_text(cell):
+    value = cell.value
+    if value is None:
+        return ''
+    return format_value(value, getattr(cell, 'number_format', None) or 'General')
+
+def format_value(value, number_format):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    compiled = compile_format(number_format)
+    if isinstance(value, str):
+        return value if compiled['text'] is None else compiled['text'][0] + value + compiled['text'][1]
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return ''.join(part if isinstance(part, str) else part(value) for part in compiled['date'])
+    if number_format == 'General':
+        return format_general(value)
+
+    # The negative section shows the number without its sign (it has its own brackets or minus); with just
+    # the one section, Excel puts a minus in front
+    numbers = compiled['numbers']
+    if value < 0:
+        return format_number(-value, numbers[1]) if len(numbers) > 1 else '-' + format_number(-value, numbers[0])
+    if value == 0 and len(numbers) > 2:
+        return format_number(value, numbers[2])
+    return format_number(value, numbers[0])
+
+def format_general(value):
+    # General shows up to ten significant digits and drops trailing zeros
+    if float(value).is_integer() and abs(value) < 1e11:
+        return str(int(value))
+    return f"{value:.10g}"
+
+def format_number(value, compiled):
+    prefix, suffix, placeholders = compiled
+    if placeholders is None:
+        return prefix
+    decimals, thousands, zeros, width = placeholders
+    text = f"{value:,.{decimals}f}" if thousands else f"{value:.{decimals}f}"
+    whole, _, fraction = text.partition('.')
+    # '#' and '?' don't show a leading zero ('?' leaves a space instead), '0' always does
+    if whole == '0' and zeros == 0:
+        whole = ''
+    whole = whole.rjust(zeros, '0').rjust(width)
+    return prefix + whole + ('.' + fraction if decimals else '') + suffix
+
+
+@functools.lru_cache(maxsize = None)
+def compile_format(number_format):
+    sections = split_sections(number_format)
+    # Only a fourth section (or a lone one with @ in it) says anything about text
+    text_section = sections[3] if len(sections) > 3 else sections[0] if '@' in sections[0] else None
+    return {
+        'text': None if text_section is None else tuple(render_literals(text_section, text = '\0').split('\0', 1)),
+        'numbers': [compile_number(section) for section in sections[:3]],
+        'date': compile_date(number_format)
+    }
+
+def split_sections(number_format):
+    # ';' splits sections unless it's inside quotes or escaped
+    sections, current, quoted, escaped = [], '', False, False
+    for character in number_format:
+        if escaped:
+            current += character
+            escaped = False
+        elif character == '\\':
+            current += character
+            escaped = True
+        elif character == '"':
+            current += character
+            quoted = not quoted
+        elif character == ';' and not quoted:
+            sections.append(current)
+            current = ''
+        else:
+            current += character
+    return sections + [current]
+
+placeholder_run = re.compile(r'[0#?][0#?,]*(?:\.[0#?]*)?|\.[0#?]+')
+
+def compile_number(section):
+    # (text before the number, text after it, how the number is written).  The first run of digit
+    # placeholders is where the number goes and everything around it is literal.  A section with no
+    # placeholders at all (a zero section like "-"??) is the same text whatever the value
+    match = placeholder_run.search(strip_literals(section))
+    if match is None:
+        return render_literals(section), '', None
+    integer_part, _, decimal_part = match.group().partition('.')
+    digits = integer_part.replace(',', '')
+    prefix, suffix = render_literals(section, number = '\0').split('\0', 1)
+    width = len(digits) if '?' in digits else 0
+    return prefix, suffix, (len(decimal_part), ',' in integer_part, digits.count('0'), width)
+
+def strip_literals(section):
+    # The section with quoted text, escapes, [brackets], _x and *x blanked out, same length, so placeholder
+    # positions line up with the original.  Only used for finding the number
+    blanked = re.sub(r'"[^"]*"', lambda match: ' ' * len(match.group()), section)
+    blanked = re.sub(r'\\.|_.|\*.', lambda match: ' ' * len(match.group()), blanked)
+    return re.sub(r'\[[^\]]*\]', lambda match: ' ' * len(match.group()), blanked)
+
+def render_literals(section, number = None, text = None):
+    # Walks the section putting out what Excel would: quoted and escaped text as is, '_x' as a space the width
+    # of x, '*x' (repeat x to fill the column) as nothing since a csv has no column width, [$$-409] as its
+    # symbol, other [brackets] (colours, conditions) not at all, the number at its placeholders and text at @
+    out = []
+    position = 0
+    match = placeholder_run.search(strip_literals(section)) if number is not None else None
+    while position < len(section):
+        character = section[position]
+        if match is not None and position == match.start():
+            out.append(number)
+            position = match.end()
+        elif character == '"':
+            end = section.index('"', position + 1)
+            out.append(section[position + 1:end])
+            position = end + 1
+        elif character == '\\':
+            out.append(section[position + 1:position + 2])
+            position += 2
+        elif character == '_':
+            out.append(' ')
+            position += 2
+        elif character == '*':
+            position += 2
+        elif character == '[':
+            end = section.index(']', position)
+            code = section[position + 1:end]
+            if code.startswith('$'):
+                out.append(code[1:].split('-')[0])
+            position = end + 1
+        elif character == '@':
+            out.append(text if text is not None else '')
+            position += 1
+        elif character in '0#?' and number is None:
+            # Placeholders with no number to show are just spaces for '?'
+            out.append(' ' if character == '?' else '0' if character == '0' else '')
+            position += 1
+        else:
+            out.append(character)
+            position += 1
+    return ''.join(out)
+
+
+# Dates.  Built-in format 14 is the locale's short date, which openpyxl reports as 'mm-dd-yy' and a US Excel
+# shows (and exports) as m/d/yy.  Anything else is worked out token by token.  The tokens are filled in by hand
+# rather than with strftime, whose codes for 'no leading zero' differ between platforms
+
+short_date_formats = {'mm-dd-yy': 'm/d/yy'}
+months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+date_tokens = {
+    'yyyy': lambda value: f"{value.year:04d}",
+    'yy': lambda value: f"{value.year % 100:02d}",
+    'mmmm': lambda value: months[value.month - 1],
+    'mmm': lambda value: months[value.month - 1][:3],
+    'mm': lambda value: f"{value.month:02d}",
+    'm': lambda value: str(value.month),
+    'dddd': lambda value: days[value.weekday()],
+    'ddd': lambda value: days[value.weekday()][:3],
+    'dd': lambda value: f"{value.day:02d}",
+    'd': lambda value: str(value.day),
+    'hh': lambda value: f"{value.hour:02d}",
+    'h': lambda value: str(value.hour),
+    'ss': lambda value: f"{value.second:02d}",
+    's': lambda value: str(value.second)
+}
+minute_tokens = {
+    'mm': lambda value: f"{value.minute:02d}",
+    'm': lambda value: str(value.minute)
+}
+
+def compile_date(number_format):
+    # A list of literal text and functions of the date, to be joined together
+    section = short_date_formats.get(number_format.lower(), split_sections(number_format)[0])
+    section = re.sub(r'\[[^\]]*\]', '', section)
+    parts = []
+    position = 0
+    lower = section.lower()
+    while position < len(section):
+        if section[position] == '"':
+            end = section.index('"', position + 1)
+            parts.append(section[position + 1:end])
+            position = end + 1
+            continue
+        if section[position] == '\\':
+            parts.append(section[position + 1:position + 2])
+            position += 2
+            continue
+        for token in date_tokens:
+            if lower.startswith(token, position):
+                if token in minute_tokens and re.search(r'h+:?$', lower[:position]):
+                    parts.append(minute_tokens[token]) # An 'm' or 'mm' straight after an hour is minutes, not the month
+                else:
+                    parts.append(date_tokens[token])
+                position += len(token)
+                break
+        else:
+            parts.append(section[position])
+            position += 1
+    return parts
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Filling in Distance roundtrip/Tx where it's blank but the zip code isn't, from how far the middle of the
+# patient's zip code is from the nearest treatment site.
+#
+# The zip code centroids come from a file next to the data rather than any web service, so cleaning never
+# waits on (or leaks patient zip codes to) anybody else.  It's loaded once into a sorted array of zip codes
+# with the coordinates in the same order, so looking up any number of rows is one np.searchsorted, and the
+# distances are worked out for every row at once with the haversine formula on whole numpy arrays.  Both
+# stay quick however many rows there are.
+#
+# A straight line undersells the drive, so it's scaled by a road factor (road distances in the US run about
+# a fifth longer than the crow flies) and doubled, since the column is a round trip.
+
+earth_radius_miles = 3958.8
+
+# The Census Bureau's ZCTA Gazetteer file can be used as is (it's tab separated, with the zip in GEOID and the
+# coordinates in INTPTLAT and INTPTLONG), or a plain csv with zip, lat and lon columns
+gazetteer_columns = {'GEOID': 'zip', 'INTPTLAT': 'lat', 'INTPTLONG': 'lon'}
+
+
+class ZipCentroids:
+    def __init__(self, zips, lat, lon):
+        order = np.argsort(zips, kind = 'stable')
+        self.zips = np.asarray(zips, dtype = np.int64)[order]
+        self.lat = np.asarray(lat, dtype = np.float64)[order]
+        self.lon = np.asarray(lon, dtype = np.float64)[order]
+
+    def lookup(self, zips):
+        # zips is a column of whole numbers with blanks.  Hands back latitude and longitude for each, NaN where
+        # the zip is blank or not in the table
+        values = pd.Series(zips).to_numpy(dtype = np.float64, na_value = np.nan)
+        present = ~np.isnan(values)
+        wanted = np.where(present, values, -1).astype(np.int64)
+        position = np.searchsorted(self.zips, wanted).clip(max = len(self.zips) - 1)
+        found = present & (self.zips[position] == wanted)
+        lat = np.full(len(values), np.nan)
+        lon = np.full(len(values), np.nan)
+        lat[found] = self.lat[position[found]]
+        lon[found] = self.lon[position[found]]
+        return lat, lon
+
+
+def load_centroids(path):
+    # None if there's no table, in which case nothing gets filled in
+    if not os.path.exists(path):
+        return None
+    table = pd.read_csv(path, sep = None, engine = 'python', dtype = str)
+    table.columns = table.columns.str.strip()
+    table = table.rename(columns = gazetteer_columns)
+    zips = pd.to_numeric(table['zip'], errors = 'coerce')
+    lat = pd.to_numeric(table['lat'], errors = 'coerce')
+    lon = pd.to_numeric(table['lon'], errors = 'coerce')
+    usable = zips.notna() & lat.notna() & lon.notna()
+    if not usable.any():
+        return None
+    return ZipCentroids(zips[usable].to_numpy(), lat[usable].to_numpy(), lon[usable].to_numpy())
+
+def load_sites(path):
+    # A csv of site, lat and lon, one row per place patients get treated.  Hands back {site: (latitude,
+    # longitude)}, empty if there's no file or nothing usable in it
+    if not os.path.exists(path):
+        return {}
+    table = pd.read_csv(path, dtype = str)
+    table.columns = table.columns.str.strip()
+    lat = pd.to_numeric(table['lat'], errors = 'coerce')
+    lon = pd.to_numeric(table['lon'], errors = 'coerce')
+    usable = lat.notna() & lon.notna()
+    return dict(zip(table['site'][usable], zip(lat[usable], lon[usable])))
+
+def haversine_miles(lat, lon, site_lat, site_lon):
+    lat, lon, site_lat, site_lon = (np.radians(value) for value in (lat, lon, site_lat, site_lon))
+    a = np.sin((site_lat - lat) / 2) ** 2 + np.cos(lat) * np.cos(site_lat) * np.sin((site_lon - lon) / 2) ** 2
+    return 2 * earth_radius_miles * np.arcsin(np.sqrt(a))
+
+def nearest_site_miles(lat, lon, sites):
+    # sites is {name: (latitude, longitude)}.  One row of distances per site, then the smallest of each column
+    coordinates = np.array(list(sites.values()), dtype = np.float64).reshape(-1, 2)
+    distances = haversine_miles(lat[None, :], lon[None, :], coordinates[:, :1], coordinates[:, 1:])
+    return distances.min(axis = 0)
+
+def impute_distances(distance, zips, centroids, sites, road_factor = 1.0):
+    # Hands back the distances with the blanks filled in where possible, and which ones were
+    distance = pd.Series(distance)
+    imputed = np.zeros(len(distance), dtype = bool)
+    if centroids is None or not sites:
+        return distance, imputed
+    blank = distance.isna().to_numpy()
+    lat, lon = centroids.lookup(pd.Series(zips)[blank])
+    estimate = np.round(2 * road_factor * nearest_site_miles(lat, lon, sites), 1)
+    filled = distance.copy()
+    imputed[blank] = ~np.isnan(estimate)
+    filled[imputed] = estimate[~np.isnan(estimate)]
+    return filled, imputed
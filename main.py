@@ -1,68 +1,142 @@
+import functools
+import hashlib
+import json
+import os
+import sys
 import pandas as pd
 import numpy as np
 import datetime as dt
-
+import cleaners
+import geo
+import matching
+import validation
+from cleaners import title, upper, strip, translate, replace, regex, contains, category, canonical, flag, money, number, zip_code, date, year_of, days_between, age_on
+from datastore import CLEANED_CSV, CLEANED_SCHEMA, CLEANED_CUBE, CLEANED_BALANCES, CLEANED_QUARANTINE, CLEANED_TRENDS, CleanedWriter, write_cleaned, read_cleaned, read_schema
+from cube import build_cube, merge_cubes, write_cube, read_cube
+from balances import build_balances, merge_balances, update_balances, write_balances, read_balances
+from trends import build_trends, merge_trends, write_trends, read_trends
+from excel import is_workbook, read_xlsx
+from geo import load_centroids, load_sites, impute_distances
+from matching import load_overrides
+from validation import in_range, before, not_before, matches, validate, write_quarantine
+from profiling import RunReport, no_report, record_changes, load_budgets, column_memory, add_memory, write_memory_report
+
+
+# main.py is the cleaning run (python main.py, or python -m main) and also the cleaning library: importing it
+# doesn't read or write anything, and clean() further down is the whole cleaning as a function of a frame.
+# The bigger modules only some runs need (multiprocessing, argparse, openpyxl, cProfile) are
+# imported where they're used, so neither an import nor a plain run pays for them.
 
 # Uniquely, I encountered a substantial issue using .xlsx on Mac.  To ensure that this works on any computer,
 # I've chosen to just use a csv file. This is a limitation, but thankfully a very, very easy one to overcome,
-# As you can literally just save an Excel sheet as a .csv file using the 'Save As' function within Excel
+# As you can literally just save an Excel sheet as a .csv file using the 'Save As' function within Excel.
+# (The workbook itself can be read now too, with --input "Data Set.xlsx", see excel.py.  It comes out exactly
+# the same as the csv export would, so the two can be swapped freely, incremental runs included)
 dataset = "Data Set.csv"
 
-df = pd.DataFrame(pd.read_csv(dataset)) 
-
-# The next step is to individually clean columns in such a way that any *new* data will not cause a python conniption
-# First, make sure none of these numbers have spaces anywhere
-df['Patient ID#'] = df['Patient ID#'].replace(' ', '')
-df['Patient ID#'] = df['Patient ID#'].astype('Int64')
+# Remembers which raw rows have already been cleaned (see clean_incremental() further down)
+state_file = "Cleaned Data Set.state.npz"
+
+# Remembers what every raw spelling in the text columns cleaned up to (see load_mappings() further down)
+mappings_file = "Cleaned Data Set.mappings.json"
+
+# The referral names picked so far (see load_mappings() further down)
+canonical_names_file = "Cleaned Data Set.canonical.json"
+
+# The files the cleaning itself is configured by live next to the code, wherever it's run from
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def output_files(csv_path = CLEANED_CSV):
+    # Everything a run writes sits next to the cleaned csv and is named after it, so --output out/Cleaned.csv
+    # gives out/Cleaned.feather, out/Cleaned.state.npz and so on.  The default is the usual Cleaned Data Set.*
+    stem = os.path.splitext(csv_path)[0]
+    return {
+        'csv': csv_path,
+        'feather': stem + '.feather',
+        'schema': stem + '.schema.json',
+        'cube': stem + '.cube.json',
+        'balances': stem + '.balances.json',
+        'trends': stem + '.trends.json',
+        'quarantine': stem + '.quarantine.csv',
+        'state': stem + '.state.npz',
+        'mappings': stem + '.mappings.json',
+        'canonical': stem + '.canonical.json'
+    }
 
-# Next, a quick conversion of the Grant Req Date column to datetime format and a removal of any spaces (just in case)
-df['Grant Req Date'] = df['Grant Req Date'].replace(' ', '')
-df['Grant Req Date'] = pd.to_datetime(df['Grant Req Date'], errors = 'coerce')
-df['Grant Req Date'] = pd.to_datetime(df['Grant Req Date'], '%Y-%m-%d')
-#
-# DATE FORMAT IS NOW YYYY-MM-DD
+# What every cleaned column ends up as.  The raw sheet is always read as plain text (read_raw() below) and
+# clean_data() finishes by casting to these, so the output types never depend on which rows were cleaned
+# together.  That matters as soon as the data gets cleaned in pieces: a chunk where every zip happens to
+# look like a number would otherwise be read as integers and fall over at the first .str call.
 #
+# They're also as small as the values allow, since every dashboard worker holds the columns its pages use.
+# Text with only a handful of distinct values (states, statuses, payment methods...) is a category, which
+# stores each value once plus a small code per row.  Whole numbers get the smallest nullable integer that
+# fits anything the cleaning can produce, with room to spare (a zip is 5 digits, a year of birth can't leave
+# what a datetime can hold), and float32 is used where a few significant digits are all there are.  Money
+# stays float64 so totals still add up to the cent.
+cleaned_dtypes = {
+    'Patient ID#': 'Int32',
+    'Grant Req Date': 'datetime64[ns]',
+    'App Year': 'float32',
+    ' Remaining Balance ': 'float64',
+    'Request Status': 'category',
+    'Payment Submitted?': 'datetime64[ns]',
+    'Reason - Pending/No': 'category',
+    'Pt City': 'category',
+    'Pt State': 'category',
+    'Pt Zip': 'Int32',
+    'Language': 'category',
+    'DOB': 'datetime64[ns]',
+    'Marital Status': 'category',
+    'Gender': 'category',
+    'Race': 'category',
+    'Hispanic/Latino': 'boolean',
+    'Sexual Orientation': 'category',
+    'Insurance Type': 'category',
+    'Household Size': 'Int8',
+    ' Total Household Gross Monthly Income ': 'float64',
+    'Distance roundtrip/Tx': 'float32',
+    'Referral Source': 'category',
+    'Referred By:': 'category',
+    'Type of Assistance (CLASS)': 'category',
+    ' Amount ': 'float64',
+    'Payment Method': 'category',
+    'Payable to:': 'object', # Mostly one-off names, so a category wouldn't save anything
+    'Patient Letter Notified? (Directly/Indirectly through rep)': 'boolean',
+    'Application Signed?': 'boolean',
+    'Notes': 'category',
+    'Payment Submitted? Boolean': 'boolean',
+    'YOB': 'Int16',
+    'Payment Method Original': 'category',
+    'grant_year': 'Int16',
+    'days_request_to_payment': 'Int32',
+    'age_at_request': 'Int16',
+    'Distance Imputed': 'boolean'
+}
+
+
+# Blank roundtrip distances are filled in from how far the patient's zip code is from the nearest place they
+# could be treated (see geo.py).  The zip code centroids are read from zip_centroids_file, which can be the
+# Census Bureau's ZCTA Gazetteer file straight from census.gov, renamed.  The sites are a csv of site, lat and
+# lon in treatment_sites_file, so adding one is an edit to that rather than to the code.  road_factor is how
+# much longer the drive is than a straight line.  Neither file ships with the code, and until both are there
+# nothing is filled in and there's no 'Distance Imputed' column either; once they are, it says which rows were
+zip_centroids_file = os.path.join(here, "zip_centroids.csv")
+treatment_sites_file = os.path.join(here, "treatment_sites.csv")
+road_factor = 1.2
+
+
+def read_raw(path = dataset, chunksize = None, columns = None):
+    # Excel workbook or csv, going by the extension.  Every cell comes back as text either way.  columns reads
+    # just those (a workbook still has to be read all the way through, so it only saves time for a csv)
+    if is_workbook(path):
+        chunks = read_xlsx(path, chunksize)
+        if columns is None:
+            return chunks
+        return chunks[columns] if chunksize is None else (chunk[columns] for chunk in chunks)
+    return pd.read_csv(path, dtype = str, chunksize = chunksize, usecols = columns)
 
-# The " Remaining Balance " column (those extra spaces are truly a bane) has a few details that really make me scratch my head
-# These include punctuation (makes sense) and using a dash whenever a remaining balance is 0 (bro why, like actually)
-# Thankfully, they're pretty simple to solve as we go in and swap things for what we want them to be, then turn the whole
-# set of numbers into real numbers (good old 2 point floats) instead of strings
-
-# This translation function effectively takes all the weird punctuation and swaps it for what I want it to be
-# As long as I don't need regex for anything, this will swap individual characters easily.
-df[' Remaining Balance '] = df[' Remaining Balance '].str.translate(str.maketrans({'$' : '', ',': '', '-': '0', '(': '-', ')': ''}))
-df[' Remaining Balance '] = df[' Remaining Balance '].astype(float).round(2) #And now to make sure it's a real number.
-
-# A fun tidbit on the above two lines is that the float conversion served as a validator/error test 
-# for the line above it, since it would lead to an error if all punctuation hadn't been caught
-
-# A simple check to ensure capitalization and spacing is consistent in Request Status
-df['Request Status'] = df['Request Status'].str.title() #Capitalizes first letter of every continuous string
-df['Request Status'] = df['Request Status'].str.strip() #Removes trailing spaces.  Notably it also breaks numbers, so strings only use case
-
-
-# Payment Submitted is an interesting column that blends dates with boolean values
-# We don't want data loss, but we can't use the date info that's there in any form save boolean
-# So, we go with a classic approach, we make a clean boolean version and tack it on as a
-# separate column that replaces the old one.  We then save the old one under a new name (not in this order, though)
-# Basically what I've done is cast everything into one form (uppercase for consistency throughout project) 
-
-df['Payment Submitted?'] = df['Payment Submitted?'].str.title()
-df['Payment Submitted?'] = df['Payment Submitted?'].str.strip()
-df['Payment Submitted? Boolean'] = df['Payment Submitted?']
-df['Payment Submitted?'] = pd.to_datetime(df['Payment Submitted?'], errors = 'coerce')
-df['Payment Submitted?'] = pd.to_datetime(df['Payment Submitted?'], '%Y-%m-%d')
-
-df['Payment Submitted? Boolean'] = df['Payment Submitted? Boolean'].replace('[0-9].*', True, regex = True)
-df['Payment Submitted? Boolean'] = df['Payment Submitted? Boolean'].replace('No', False)
-df['Payment Submitted? Boolean'] = df['Payment Submitted? Boolean'].replace('Yes', True)
-
-# For the cities, opting to simply remove punctuation and cast as uppercase.  Also replacing missing values with blanks.
-
-df['Pt City'] = df['Pt City'].str.translate(str.maketrans({'.': '', ',': '', '(': '', '?': '', ')': ''}))
-df['Pt City'] = df['Pt City'].str.title()
-df['Pt City'] = df['Pt City'].str.strip()
-df['Pt City'] = df['Pt City'].replace('Missing', np.nan)
 
 # For states, we have to somehow figure out a way to convert full names to abbreviations or vice versa.
 # The following function 'state_abbrev_mapping()' is *not* an original of my own design but rather a publicly available version 
@@ -70,6 +144,120 @@ df['Pt City'] = df['Pt City'].replace('Missing', np.nan)
 # https://medium.com/@jason_the_data_scientist/python-mapping-state-abbreviations-to-state-and-vice-versa-in-pandas-e4cd24edefb0
 
 
+#List of states.  These live out here (instead of being rebuilt inside the function on every call) so the
+#cleaning table further down can use abbrev2state directly
+state2abbrev = {
+    'Alaska': 'AK',
+    'Alabama': 'AL',
+    'Arkansas': 'AR',
+    'Arizona': 'AZ',
+    'California': 'CA',
+    'Colorado': 'CO',
+    'Connecticut': 'CT',
+    'District of Columbia': 'DC',
+    'Delaware': 'DE',
+    'Florida': 'FL',
+    'Georgia': 'GA',
+    'Hawaii': 'HI',
+    'Iowa': 'IA',
+    'Idaho': 'ID',
+    'Illinois': 'IL',
+    'Indiana': 'IN',
+    'Kansas': 'KS',
+    'Kentucky': 'KY',
+    'Louisiana': 'LA',
+    'Massachusetts': 'MA',
+    'Maryland': 'MD',
+    'Maine': 'ME',
+    'Michigan': 'MI',
+    'Minnesota': 'MN',
+    'Missouri': 'MO',
+    'Mississippi': 'MS',
+    'Montana': 'MT',
+    'North Carolina': 'NC',
+    'North Dakota': 'ND',
+    'Nebraska': 'NE',
+    'New Hampshire': 'NH',
+    'New Jersey': 'NJ',
+    'New Mexico': 'NM',
+    'Nevada': 'NV',
+    'New York': 'NY',
+    'Ohio': 'OH',
+    'Oklahoma': 'OK',
+    'Oregon': 'OR',
+    'Pennsylvania': 'PA',
+    'Rhode Island': 'RI',
+    'South Carolina': 'SC',
+    'South Dakota': 'SD',
+    'Tennessee': 'TN',
+    'Texas': 'TX',
+    'Utah': 'UT',
+    'Virginia': 'VA',
+    'Vermont': 'VT',
+    'Washington': 'WA',
+    'Wisconsin': 'WI',
+    'West Virginia': 'WV',
+    'Wyoming': 'WY',
+    'Puerto Rico': 'PR',
+    'Virigin Islands': 'VI'
+}
+
+abbrev2state = {
+    'AK': 'Alaska',
+    'AL': 'Alabama',
+    'AR': 'Arkansas',
+    'AZ': 'Arizona',
+    'CA': 'California',
+    'CO': 'Colorado',
+    'CT': 'Connecticut',
+    'DC': 'District of Columbia',
+    'DE': 'Delaware',
+    'FL': 'Florida',
+    'GA': 'Georgia',
+    'HI': 'Hawaii',
+    'IA': 'Iowa',
+    'ID': 'Idaho',
+    'IL': 'Illinois',
+    'IN': 'Indiana',
+    'KS': 'Kansas',
+    'KY': 'Kentucky',
+    'LA': 'Louisiana',
+    'MA': 'Massachusetts',
+    'MD': 'Maryland',
+    'ME': 'Maine',
+    'MI': 'Michigan',
+    'MN': 'Minnesota',
+    'MO': 'Missouri',
+    'MS': 'Mississippi',
+    'MT': 'Montana',
+    'NC': 'North Carolina',
+    'ND': 'North Dakota',
+    'NE': 'Nebraska',
+    'NH': 'New Hampshire',
+    'NJ': 'New Jersey',
+    'NM': 'New Mexico',
+    'NV': 'Nevada',
+    'NY': 'New York',
+    'OH': 'Ohio',
+    'OK': 'Oklahoma',
+    'OR': 'Oregon',
+    'PA': 'Pennsylvania',
+    'RI': 'Rhode Island',
+    'SC': 'South Carolina',
+    'SD': 'South Dakota',
+    'TN': 'Tennessee',
+    'TX': 'Texas',
+    'UT': 'Utah',
+    'VA': 'Virginia',
+    'VT': 'Vermont',
+    'WA': 'Washington',
+    'WI': 'Wisconsin',
+    'WV': 'West Virginia',
+    'WY': 'Wyoming',
+    'PR': 'Puerto Rico',
+    'VI': 'Virigin Islands'
+}
+
 def state_abbrev_mapping(df, col, output_abbr = False, add_new_col = False, new_col = None,  case = None):
     #df =  the Pandas dataframe.
     #col = String. The column with the state name or abbreviation you wish to use
@@ -78,121 +266,6 @@ def state_abbrev_mapping(df, col, output_abbr = False, add_new_col = False, new_
     #new_col = String. Name of new column you wish to add.
     #case = 'upper', 'lower', or None. Do you want to specify a letter-case for the data?
  
- 
-    #List of states
-    state2abbrev = {
-        'Alaska': 'AK',
-        'Alabama': 'AL',
-        'Arkansas': 'AR',
-        'Arizona': 'AZ',
-        'California': 'CA',
-        'Colorado': 'CO',
-        'Connecticut': 'CT',
-        'District of Columbia': 'DC',
-        'Delaware': 'DE',
-        'Florida': 'FL',
-        'Georgia': 'GA',
-        'Hawaii': 'HI',
-        'Iowa': 'IA',
-        'Idaho': 'ID',
-        'Illinois': 'IL',
-        'Indiana': 'IN',
-        'Kansas': 'KS',
-        'Kentucky': 'KY',
-        'Louisiana': 'LA',
-        'Massachusetts': 'MA',
-        'Maryland': 'MD',
-        'Maine': 'ME',
-        'Michigan': 'MI',
-        'Minnesota': 'MN',
-        'Missouri': 'MO',
-        'Mississippi': 'MS',
-        'Montana': 'MT',
-        'North Carolina': 'NC',
-        'North Dakota': 'ND',
-        'Nebraska': 'NE',
-        'New Hampshire': 'NH',
-        'New Jersey': 'NJ',
-        'New Mexico': 'NM',
-        'Nevada': 'NV',
-        'New York': 'NY',
-        'Ohio': 'OH',
-        'Oklahoma': 'OK',
-        'Oregon': 'OR',
-        'Pennsylvania': 'PA',
-        'Rhode Island': 'RI',
-        'South Carolina': 'SC',
-        'South Dakota': 'SD',
-        'Tennessee': 'TN',
-        'Texas': 'TX',
-        'Utah': 'UT',
-        'Virginia': 'VA',
-        'Vermont': 'VT',
-        'Washington': 'WA',
-        'Wisconsin': 'WI',
-        'West Virginia': 'WV',
-        'Wyoming': 'WY',
-        'Puerto Rico': 'PR',
-        'Virigin Islands': 'VI'
-    }
- 
-    #List of states
-    abbrev2state = {
-        'AK': 'Alaska',
-        'AL': 'Alabama',
-        'AR': 'Arkansas',
-        'AZ': 'Arizona',
-        'CA': 'California',
-        'CO': 'Colorado',
-        'CT': 'Connecticut',
-        'DC': 'District of Columbia',
-        'DE': 'Delaware',
-        'FL': 'Florida',
-        'GA': 'Georgia',
-        'HI': 'Hawaii',
-        'IA': 'Iowa',
-        'ID': 'Idaho',
-        'IL': 'Illinois',
-        'IN': 'Indiana',
-        'KS': 'Kansas',
-        'KY': 'Kentucky',
-        'LA': 'Louisiana',
-        'MA': 'Massachusetts',
-        'MD': 'Maryland',
-        'ME': 'Maine',
-        'MI': 'Michigan',
-        'MN': 'Minnesota',
-        'MO': 'Missouri',
-        'MS': 'Mississippi',
-        'MT': 'Montana',
-        'NC': 'North Carolina',
-        'ND': 'North Dakota',
-        'NE': 'Nebraska',
-        'NH': 'New Hampshire',
-        'NJ': 'New Jersey',
-        'NM': 'New Mexico',
-        'NV': 'Nevada',
-        'NY': 'New York',
-        'OH': 'Ohio',
-        'OK': 'Oklahoma',
-        'OR': 'Oregon',
-        'PA': 'Pennsylvania',
-        'RI': 'Rhode Island',
-        'SC': 'South Carolina',
-        'SD': 'South Dakota',
-        'TN': 'Tennessee',
-        'TX': 'Texas',
-        'UT': 'Utah',
-        'VA': 'Virginia',
-        'VT': 'Vermont',
-        'WA': 'Washington',
-        'WI': 'Wisconsin',
-        'WV': 'West Virginia',
-        'WY': 'Wyoming',
-        'PR': 'Puerto Rico',
-        'VI': 'Virigin Islands'
-    }
-     
     #If user wants to add a new column
     if add_new_col == False:
          
@@ -231,189 +304,685 @@ def state_abbrev_mapping(df, col, output_abbr = False, add_new_col = False, new_
  
     return(df)
 
-df['Pt State'] = df['Pt State'].str.upper()
-df['Pt State'] = df['Pt State'].str.strip()
-state_abbrev_mapping(df, 'Pt State')
-df['Pt State'] = df['Pt State'].str.title()
-
-# With the above function having run, we now have a consistent format for states as their respective names. 
-# Now we replace any case of the "Missing" value with blank ones.  We can alter the blanks later if needed, but this is consistent for now.
-df['Pt State'] = df['Pt State'].replace('(?i)missing', np.nan, regex = True)
-
-# Someone entered 698863 incorrectly.  Took a manual look at the city and found the zipcode error with a quick Google search
-df['Pt Zip'] = df['Pt Zip'].str.replace(" ", "")
-df['Pt Zip'] = df['Pt Zip'].replace('698863', '68863')
-df['Pt Zip'] = df['Pt Zip'].astype(str).str[:5] # Just the first five digits of the zip code
-df['Pt Zip'] = pd.to_numeric(df['Pt Zip'], errors = 'coerce')
-df['Pt Zip'] = df['Pt Zip'].astype('Int64')
-
-# Language data cleaning
-df['Language'] = df['Language'].str.title()
-df['Language'] = df['Language'].str.strip()
-df['Language'] = df['Language'].replace('(?i)missing', np.nan, regex = True)
-# So it turns out according to Glen that 'Karen' is  pronounced 'Kah-Ren' and it's an ethnic group form Myanmar
-# On this note, it's back in the dataset
-df['Language'] = df['Language'].replace('English, Spanish', 'English') # Keeping things simple at one language
-
-
-# DOB data cleaning
-df['DOB'] = df['DOB'].replace('(?i)missing', np.nan, regex = True)
-
-df['DOB'] = pd.to_datetime(df['DOB'], errors = 'coerce')
-df['DOB'] = pd.to_datetime(df['DOB'], '%Y-%m-%d') # Notably some of these are birth year only, so that's the only thing we can really use
-df.loc[df['DOB'] > pd.Timestamp.today(), 'DOB'] = pd.NaT # Some people were apparently from the future so I disabled time traveling
-df['YOB'] = df['DOB'].dt.year # YOB column for the sake of some data preservation
-
-# Marital Status data cleaning (Yes, I know I had all those fancy descriptions earlier. Truth is, though, https://tenor.com/cZESrBQb5Qu.gif)
-
-df['Marital Status'] = df['Marital Status'].str.title()
-df['Marital Status'] = df['Marital Status'].str.strip()
-df['Marital Status'] = df['Marital Status'].replace("Seperated", 'Separated')
-df['Marital Status'] = df['Marital Status'].replace('(?i)missing', np.nan, regex = True)
-
-# Gender data cleaning
-df['Gender'] = df['Gender'].str.title()
-df['Gender'] = df['Gender'].str.strip()
-df['Gender'] = df['Gender'].replace('Missing', np.nan)
-
-
-# Race data cleaning
-df['Race'] = df['Race'].str.title()
-df['Race'] = df['Race'].str.strip()
-df['Race'] = df['Race'].replace('(?i)whiate', 'white', regex = True)
-df['Race'] = df['Race'].apply(lambda x: "American Indian or Alaskan Native" if "Indian Or" in str(x) else x)
-df['Race'] = df['Race'].replace('(?i)decline to answer', np.nan, regex = True)
-df['Race'] = df['Race'].replace('(?i)missing', np.nan, regex = True)
-df['Race'] = df['Race'].replace('(?i)hispanic', 'Other', regex = True)
-df['Race'] = df['Race'].replace('(?i)two or more races', 'Other', regex = True)
-
-# Hispanic or Latino data cleaning.
-df['Hispanic/Latino'] = df['Hispanic/Latino'].str.title()
-df['Hispanic/Latino'] = df['Hispanic/Latino'].str.strip()
-df['Hispanic/Latino'] = df['Hispanic/Latino'].replace('^No.*', False, regex = True)
-df['Hispanic/Latino'] = df['Hispanic/Latino'].replace('^His.*', True, regex = True)
-df['Hispanic/Latino'] = df['Hispanic/Latino'].replace('Yes', True)
-df['Hispanic/Latino'] = df['Hispanic/Latino'].replace('(?i)decline to answer', np.nan, regex = True)
-df['Hispanic/Latino'] = df['Hispanic/Latino'].replace('(?i)missing', np.nan, regex = True)
-
-# Sexual Orientation data cleaning.
-df['Sexual Orientation'] = df['Sexual Orientation'].str.title()
-df['Sexual Orientation'] = df['Sexual Orientation'].str.strip()
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)d.*', np.nan, regex = True)
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)st.*', 'Heterosexual', regex = True)
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)missing', np.nan, regex = True)
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)gay or lesbian', 'Homosexual', regex = True)
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)female', np.nan, regex = True)
-df['Sexual Orientation'] = df['Sexual Orientation'].replace('(?i)male', np.nan, regex = True)
-
-# Insuramce Type data cleaning.  It took me this long to realize I could have cast 
-# so many other lines with .str.title() *before* approaching for data consistency 
-# Wouldn't have even needed any regex had I done that.  Time to go back and fix that.  I guess you live and learn.
-df['Insurance Type'] = df['Insurance Type'].str.title()
-df['Insurance Type'] = df['Insurance Type'].str.strip()
-df['Insurance Type'] = df['Insurance Type'].replace('(?i)uni.*', "Uninsured", regex = True)
-df['Insurance Type'] = df['Insurance Type'].replace('Unknown', np.nan)
-df['Insurance Type'] = df['Insurance Type'].replace('Missing', np.nan)
-df['Insurance Type'] = df['Insurance Type'].replace('Heathcare.Gov', np.nan) # This person is insured, but Healthcare.gov is a marketplace to get *any* kind of insurance
-df['Insurance Type'] = df['Insurance Type'].replace('Medicaid & Medicare', 'Medicare & Medicaid') # Consistency
-df['Insurance Type'] = df['Insurance Type'].replace('Medicare & Other')
-
-# Household Size data cleaning
-
-df['Household Size'] = df['Household Size'].replace(' ','')
-df['Household Size'] = df['Household Size'].replace('(?i)missing', np.nan, regex = True)
-df['Household Size'] = df['Household Size'].astype(float).round(1)
-df.loc[df['Household Size'] > 15] = np.nan # Is 15 totally arbitrary?  Yes, absolutely.  Does it take care of the entry that was over 4,000?  Also yes.
-
-# Household Income data cleaning
-
-df[' Total Household Gross Monthly Income '] = df[' Total Household Gross Monthly Income '].replace(' ', '')
-df[' Total Household Gross Monthly Income '] = df[' Total Household Gross Monthly Income '].str.translate(str.maketrans({'$' : '', ',': '', '-': '0', '(': '-', ')': ''}))
-df[' Total Household Gross Monthly Income '] = df[' Total Household Gross Monthly Income '].replace('(?i)missing', np.nan, regex = True)
-df[' Total Household Gross Monthly Income '] = df[' Total Household Gross Monthly Income '].replace('[.].*[.].*', np.nan, regex = True)
-df[' Total Household Gross Monthly Income '] = df[' Total Household Gross Monthly Income '].astype(float).round(2)
-
-# Distance roundtrip data cleaning.  Based on dataset, this one was conveniently super straightforward
-
-df['Distance roundtrip/Tx'] = pd.to_numeric(df['Distance roundtrip/Tx'], errors = 'coerce')
-
-# Referral Source Data cleaning.  These are arguably too much to reliably sift as many new sources could be added.
-# To keep things straightforward, I'm opting to simply capitalize everything and remove trailing spaces and
-# missing values as a precaution.  What I wish I could have done was used NLP to detect names, match them, and then coerce,
-# but my attempt at this failed miserably and I didn't have the time to fix it in the slightest.  Might mess around with this
-# in the summer if I really want to push through with the data analytics concentration.  Could use the added practice.
-
-df['Referral Source'] = df['Referral Source'].str.upper()
-df['Referral Source'] = df['Referral Source'].str.strip()
-df['Referral Source'] = df['Referral Source'].replace('MISSING', np.nan)
-
-# Referred By: data cleaning.  Similar story here as Referral Source.
-
-df['Referred By:'] = df['Referred By:'].str.strip()
-df['Referred By:'] = df['Referred By:'].str.upper()
-df['Referred By:'] = df['Referred By:'].replace('MISSING', np.nan)
-
-# Type of Assistance data cleaning
-
-df['Type of Assistance (CLASS)'] = df['Type of Assistance (CLASS)'].str.strip()
-df['Type of Assistance (CLASS)'] = df['Type of Assistance (CLASS)'].str.title()
-df['Type of Assistance (CLASS)'] = df['Type of Assistance (CLASS)'].replace('Multiple', 'Other')
-df['Type of Assistance (CLASS)'] = df['Type of Assistance (CLASS)'].replace('Missing', np.nan)
-
-# Amount data cleaning.  At this stage it occurred to me I probably could have just made
-# Specific functions that cleaned specific data types, like "Dollar data clean" or "String data clean."
-# Hindsight may be 20/20, but boy does it make you feel really stupid sometimes.
-
-df[' Amount '] = df[' Amount '].str.translate(str.maketrans({' ': '', '$' : '', ',': '', '-': '0', '(': '-', ')': ''}))
-df[' Amount '] = pd.to_numeric(df[' Amount '], errors = 'coerce')
-
-# Payment Method data cleaning
-
-df['Payment Method Original'] = df['Payment Method'].str.upper() # data preservation
-df['Payment Method'] = df['Payment Method'].str.upper()
-df['Payment Method'] = df['Payment Method'].replace('.*[C][K].*', 'CK', regex = True)
-df['Payment Method'] = df['Payment Method'].replace('.*[C][C].*', 'CC', regex = True)
-df['Payment Method'] = df['Payment Method'].replace('.*[G][C].*', 'GC', regex = True)
-df['Payment Method'] = df['Payment Method'].replace('.*[J].*[E].*', 'JE', regex = True)
-df['Payment Method'] = df['Payment Method'].replace('BANK TRANSACTION', 'OTHER') # Bruteforcing this bothered me, but I was rushing too much the last few days
-df['Payment Method'] = df['Payment Method'].replace('NCS DUE TO/FROM', 'OTHER')
-df['Payment Method'] = df['Payment Method'].replace('CASH', 'OTHER')
-df['Payment Method'] = df['Payment Method'].replace('ACH', 'OTHER')
-df['Payment Method'] = df['Payment Method'].replace('EFT', 'OTHER')
-df['Payment Method'] = df['Payment Method'].replace('1575.86', 'OTHER')
-df['Payment Method'] = df['Payment Method'].replace('?', np.nan)
-df['Payment Method'] = df['Payment Method'].replace('MISSING', np.nan)
-df['Payment Method'] = df['Payment Method'].replace('PENDING', np.nan)
-
-# Payable to: data cleaning
-
-df['Payable to:'] = df['Payable to:'].str.strip()
-df['Payable to:'] = df['Payable to:'].replace('(?i)missing', np.nan, regex = True)
-
-# Patient Letter Notified? data cleaning
-
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('[0-9].*', True, regex = True)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].str.upper()
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].str.strip()
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('', np.nan)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('MISSING', np.nan)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('NA', np.nan)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('HOLD', np.nan)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('YES', True)
-df['Patient Letter Notified? (Directly/Indirectly through rep)'] = df['Patient Letter Notified? (Directly/Indirectly through rep)'].replace('NO', False)
-
-
-# Application Signed? data cleaning
 
-df['Application Signed?'] = df['Application Signed?'].str.title()
-df['Application Signed?'] = df['Application Signed?'].str.strip()
-df['Application Signed?'] = df['Application Signed?'].replace('Missing', np.nan)
-df['Application Signed?'] = df['Application Signed?'].replace('Yes', True)
-df['Application Signed?'] = df['Application Signed?'].replace('No', False)
+# Hand-made corrections to the referral names (see matching.py), kept in a csv of column, spelling, canonical
+canonical_overrides_file = os.path.join(here, "canonical_overrides.csv")
 
+@functools.cache
+def canonical_overrides(column):
+    # Read the first time a referral column is cleaned, not on import
+    return load_overrides(canonical_overrides_file).get(column)
 
-# Write to new and squeaky clean file
-df.to_csv('Cleaned Data Set.csv')
 
-
-# Well. . . That was exhausting and terribly inefficient.  Time to make the dashboard
\ No newline at end of file
+# How every column gets cleaned, one entry per column (see cleaners.py for what each kind of cleaner does).
+# The rules inside an entry run in the order they're written, and columns the table doesn't mention (Notes,
+# Reason - Pending/No and the blank placeholder columns) are passed through untouched.  Adding a column is
+# just adding a line here.
+#
+# Every rule only ever looks at the row it is on, which is what lets clean_incremental() and clean_streaming()
+# hand clean_data() a piece of the sheet and get the same answer a full run would.
+
+# Every date in the sheet is written month/day/year, with either a two or four digit year.  Those two are
+# tried first since they can be read in one vectorized sweep; mixed = True hands anything else to pandas'
+# much slower date-guessing, one value at a time
+sheet_dates = ['%m/%d/%y', '%m/%d/%Y']
+
+column_cleaners = {
+    'Patient ID#': number(dtype = 'Int64'),
+    'App Year': number(),
+    'Grant Req Date': date(formats = sheet_dates, mixed = True),
+    ' Remaining Balance ': money(round_to = 2), # Those extra spaces in the column name are truly a bane
+    'Request Status': category(title, strip),
+
+    # Payment Submitted blends dates with Yes/No.  The dates are kept as real dates here, and the clean boolean
+    # version goes into its own column further down so no information is lost
+    'Payment Submitted?': date(title, strip, formats = sheet_dates, mixed = True),
+
+    'Pt City': category(translate({'.': '', ',': '', '(': '', '?': '', ')': ''}), title, strip, replace({'Missing': np.nan})),
+
+    # Abbreviations are swapped for full state names, so every state is spelled out consistently
+    'Pt State': category(upper, strip, replace(abbrev2state), title, regex('(?i)missing', np.nan)),
+
+    # Zip codes that aren't five digits (or zip+4) are dealt with in validation_rules below
+    'Pt Zip': zip_code(),
+
+    # So it turns out according to Glen that 'Karen' is  pronounced 'Kah-Ren' and it's an ethnic group form Myanmar
+    # On this note, it's back in the dataset.  'English, Spanish' is kept simple at one language
+    'Language': category(title, strip, regex('(?i)missing', np.nan), replace({'English, Spanish': 'English'})),
+
+    # Only four digit years here: a birthday written 5/27/60 could be 1960 or 2060, so it's left blank
+    'DOB': date(formats = ['%m/%d/%Y']),
+
+    'Marital Status': category(title, strip, replace({'Seperated': 'Separated'}), regex('(?i)missing', np.nan)),
+    'Gender': category(title, strip, replace({'Missing': np.nan})),
+    'Race': category(title, strip, regex('(?i)whiate', 'white'), contains('Indian Or', 'American Indian or Alaskan Native'),
+                     regex('(?i)decline to answer', np.nan), regex('(?i)missing', np.nan),
+                     regex('(?i)hispanic', 'Other'), regex('(?i)two or more races', 'Other')),
+    'Hispanic/Latino': flag(title, strip, regex('^No.*', False), regex('^His.*', True), replace({'Yes': True}),
+                            regex('(?i)decline to answer', np.nan), regex('(?i)missing', np.nan)),
+    'Sexual Orientation': category(title, strip, regex('(?i)d.*', np.nan), regex('(?i)st.*', 'Heterosexual'), regex('(?i)missing', np.nan),
+                                   regex('(?i)gay or lesbian', 'Homosexual'), regex('(?i)female', np.nan), regex('(?i)male', np.nan)),
+
+    # Heathcare.gov means the person is insured, but it's a marketplace to get *any* kind of insurance
+    'Insurance Type': category(title, strip, regex('(?i)uni.*', 'Uninsured'),
+                               replace({'Unknown': np.nan, 'Missing': np.nan, 'Heathcare.Gov': np.nan,
+                                        'Medicaid & Medicare': 'Medicare & Medicaid'})),
+
+    'Household Size': number(round_to = 0), # People come in whole numbers
+    ' Total Household Gross Monthly Income ': money(round_to = 2),
+    'Distance roundtrip/Tx': number(),
+
+    # These are arguably too much to reliably sift by hand as many new sources could be added, so after being
+    # capitalized and stripped, spellings close enough to each other are folded into the most common one
+    # (JULIE DRAGOO and JUILE DRAGOO, KELLIE STERKEL and KELLIE STERKEL-SW).  canonical_overrides_file has the
+    # ones that no amount of spelling would catch
+    'Referral Source': canonical(upper, strip, replace({'MISSING': np.nan}), overrides = functools.partial(canonical_overrides, 'Referral Source')),
+    'Referred By:': canonical(strip, upper, replace({'MISSING': np.nan}), people = True, overrides = functools.partial(canonical_overrides, 'Referred By:')),
+
+    'Type of Assistance (CLASS)': category(strip, title, replace({'Multiple': 'Other', 'Missing': np.nan})),
+    ' Amount ': money(),
+    'Payment Method Original': category(upper, source = 'Payment Method'), # data preservation
+    'Payment Method': category(upper, regex('.*[C][K].*', 'CK'), regex('.*[C][C].*', 'CC'), regex('.*[G][C].*', 'GC'), regex('.*[J].*[E].*', 'JE'),
+                               replace({'BANK TRANSACTION': 'OTHER', 'NCS DUE TO/FROM': 'OTHER', 'CASH': 'OTHER', 'ACH': 'OTHER',
+                                        'EFT': 'OTHER', '?': np.nan, 'MISSING': np.nan, 'PENDING': np.nan})),
+    'Payable to:': category(strip, regex('(?i)missing', np.nan)),
+
+    # A date in this column means the letter went out, so it counts as a yes
+    'Patient Letter Notified? (Directly/Indirectly through rep)': flag(regex('[0-9].*', True), upper, strip,
+                                                                       replace({'': np.nan, 'MISSING': np.nan, 'NA': np.nan, 'HOLD': np.nan,
+                                                                                'YES': True, 'NO': False})),
+    'Application Signed?': flag(title, strip, replace({'Missing': np.nan, 'Yes': True, 'No': False})),
+
+    # The data preservation columns, built from the ones above
+    'Payment Submitted? Boolean': flag(title, strip, regex('[0-9].*', True), replace({'No': False, 'Yes': True}), source = 'Payment Submitted?'),
+    'YOB': year_of('DOB'), # YOB column for the sake of some data preservation
+
+    # Worked out once here so the dashboard never has to turn text into dates
+    'grant_year': year_of('Grant Req Date'),
+    'days_request_to_payment': days_between('Grant Req Date', 'Payment Submitted?'),
+    'age_at_request': age_on('DOB', 'Grant Req Date')
+}
+
+
+# The columns worked out from each cleaned column, which go blank along with it
+derived_columns = {}
+for column, cleaner in column_cleaners.items():
+    for source in cleaner.source if cleaner.cleaned else ():
+        derived_columns.setdefault(source, []).append(column)
+
+# Checks on the cleaned values (see validation.py).  A cell that fails is blanked, unless the rule says what it
+# should be, and its row goes to the quarantine file with the reasons.  Only that cell goes: the household
+# check used to blank the entire row, grant amounts included
+validation_rules = [
+    # Someone entered 698863 incorrectly.  Took a manual look at the city and found the zipcode error with a quick Google search
+    matches('Pt Zip', r'\d{5}(-\d{4})?', "Pt Zip isn't 5 digits", raw = True, ignore = ' ', corrections = {'698863': 68863}),
+
+    # Is 15 totally arbitrary?  Yes, absolutely.  Does it take care of the entry that was over 4,000?  Also yes.
+    in_range('Household Size', "Household Size over 15", high = 15),
+
+    in_range(' Amount ', "Amount below 0", low = 0),
+
+    # Some people were apparently from the future so I disabled time traveling
+    in_range('DOB', "DOB in the future", high = pd.Timestamp.today),
+    before('DOB', 'Grant Req Date', "DOB not before Grant Req Date"),
+
+    not_before('Payment Submitted?', 'Grant Req Date', "Payment Submitted? before Grant Req Date"),
+
+    # A dollar amount ended up in Payment Method once (1575.86).  Whatever it was paid with, it's not one of the usual ones
+    matches('Payment Method', r'.*[A-Z].*', "Payment Method has no letters in it", otherwise = 'OTHER')
+]
+
+def clean_column(column, values, known):
+    # Returns known as well, since a worker process adds to its own copy of it rather than the caller's
+    cleaner = column_cleaners[column]
+    return (cleaner(values, known) if cleaner.mapped else cleaner(values)), known
+
+
+def can_fork():
+    # Only asked when there's more than one worker, so a single process run never imports multiprocessing
+    import multiprocessing
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def clean_columns(df, mappings, workers = 1, report = no_report):
+    # Runs every entry in column_cleaners and hands back the cleaned columns by name
+    # Entries whose column isn't in df are skipped, and so is anything worked out from them
+    stages = []
+    for column, cleaner in column_cleaners.items():
+        sources = cleaner.source if cleaner.cleaned else [cleaner.source or column]
+        if all(source in (stages if cleaner.cleaned else df) for source in sources):
+            stages.append(column)
+    if workers > 1 and can_fork():
+        # The columns overlap in time here, so they're only reported as one lump
+        with report.stage(f'clean_columns ({workers} workers)') as record:
+            cleaned = clean_columns_parallel(df, stages, mappings, workers)
+            record['rows'] = len(df)
+        return cleaned
+
+    cleaned = {}
+    for column in stages:
+        cleaner = column_cleaners[column]
+        values = tuple(cleaned[source] for source in cleaner.source) if cleaner.cleaned else df[cleaner.source or column]
+        with report.stage(f'clean: {column}') as record:
+            cleaned[column], mappings[column] = clean_column(column, values, mappings.get(column, {}))
+        if report.enabled:
+            record_changes(record, values, cleaned[column])
+    return cleaned
+
+def assemble_cleaned(df, cleaned):
+    # Columns that didn't exist in the raw sheet go on the end, in the order cleaned_dtypes lists them
+    new_columns = [column for column in cleaned_dtypes if column in cleaned and column not in df]
+    return pd.DataFrame({column: cleaned.get(column, df.get(column)) for column in [*df.columns, *new_columns]}, index = df.index)
+
+@functools.cache
+def zip_centroids():
+    # Read once per run, however many chunks get cleaned
+    return load_centroids(zip_centroids_file)
+
+@functools.cache
+def treatment_sites():
+    return load_sites(treatment_sites_file)
+
+def fill_distances(df):
+    if 'Distance roundtrip/Tx' not in df or 'Pt Zip' not in df or zip_centroids() is None or not treatment_sites():
+        return df
+    distance, imputed = impute_distances(df['Distance roundtrip/Tx'], df['Pt Zip'], zip_centroids(), treatment_sites(), road_factor)
+    return df.assign(**{'Distance roundtrip/Tx': distance, 'Distance Imputed': imputed})
+
+def cast_cleaned(df):
+    # A whole number too big for its column (a typo, most likely) is blanked like any other junk, rather than
+    # taking the whole run down with it
+    dtypes = {column: dtype for column, dtype in cleaned_dtypes.items() if column in df}
+    fitted = {}
+    for column, dtype in dtypes.items():
+        if dtype.startswith('Int') and pd.api.types.is_numeric_dtype(df[column]):
+            limits = np.iinfo(dtype.lower())
+            fitted[column] = df[column].where(df[column].between(limits.min, limits.max))
+    return df.assign(**fitted).astype(dtypes)
+
+def clean_data(df, mappings = None, workers = 1, report = no_report, quarantine = None):
+    # mappings is the raw spelling -> cleaned value dict for each text column (see load_mappings()).  Whatever
+    # new spellings this run comes across get added to it.  report collects timings and such (see profiling.py).
+    # quarantine, if given, is a list that gets the validation reasons for the rows that broke a rule
+    mappings = {} if mappings is None else mappings
+    raw = df
+    cleaned = clean_columns(raw, mappings, workers, report)
+
+    with report.stage('assemble_cleaned') as record:
+        df = assemble_cleaned(raw, cleaned)
+        record['rows'] = len(df)
+
+    with report.stage('validate') as record:
+        validated, reasons = validate(df, raw, validation_rules, derived_columns)
+        record['rows'] = len(df)
+    if report.enabled:
+        changes = [record_changes({}, df[column], validated[column]) for column in df if not df[column].equals(validated[column])]
+        record['nulls_introduced'] = sum(change['nulls_introduced'] for change in changes)
+        record['values_changed'] = sum(change['values_changed'] for change in changes)
+    if quarantine is not None:
+        quarantine.append(reasons)
+    df = validated
+
+    # After validation, so a zip code that was thrown out doesn't get a distance
+    with report.stage('fill_distances') as record:
+        df = fill_distances(df)
+        record['rows'] = len(df)
+
+    with report.stage('cast_cleaned') as record:
+        df = cast_cleaned(df)
+        record['rows'] = len(df)
+    return df
+
+
+# Parallel cleaning.  Each entry in column_cleaners only reads its own raw column, so they can all run at the
+# same time in separate processes.  The only exceptions are the entries marked cleaned (YOB needs DOB parsed
+# first), which wait for every column they read and are handed the cleaned versions once they're done; Payment
+# Submitted? Boolean reads the *raw* Payment Submitted? column, so it doesn't have to wait.  The validation
+# rules compare columns with each other, so they stay in clean_data() and run once all the columns are back.
+#
+# The workers are forked after shared_raw is set, so they already have the raw sheet (shared copy-on-write
+# with this process rather than copied) and only the column name goes across to them.  The cleaned column
+# does have to come back.  Where fork isn't available (Windows), clean_data() just runs the columns one
+# after another, which gives exactly the same result.
+
+shared_raw = None
+
+def clean_shared_column(column, known, values = None):
+    if values is None:
+        values = shared_raw[column_cleaners[column].source or column]
+    return clean_column(column, values, known)
+
+def clean_columns_parallel(df, stages, mappings, workers):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    global shared_raw
+    shared_raw = df
+    cleaned = {}
+    waiting = {column: set(column_cleaners[column].source) for column in stages if column_cleaners[column].cleaned}
+    try:
+        with ProcessPoolExecutor(workers, mp_context = multiprocessing.get_context('fork')) as pool:
+            running = {pool.submit(clean_shared_column, column, mappings.get(column, {})): column
+                       for column in stages if column not in waiting}
+            while running:
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    column = running.pop(future)
+                    cleaned[column], mappings[column] = future.result()
+                    # Anything that was only waiting on this column can go now
+                    for sources in waiting.values():
+                        sources.discard(column)
+                    for dependent in [dependent for dependent, sources in waiting.items() if not sources]:
+                        del waiting[dependent]
+                        values = tuple(cleaned[source] for source in column_cleaners[dependent].source)
+                        running[pool.submit(clean_shared_column, dependent, mappings.get(dependent, {}), values)] = dependent
+    finally:
+        shared_raw = None
+    return cleaned
+
+
+# The text columns (Race, Insurance Type, Pt City, Payment Method and friends) only ever hold a few hundred
+# different spellings between them, so the cleaners run their rules once per spelling rather than once per row.
+# The answers are kept in mappings_file between runs as well, so next time a spelling that's been seen before
+# is just a dictionary lookup and only brand new spellings go through the rules.  Like the row state, the
+# mappings are thrown away whenever the cleaning code changes.  Blanks are stored as null in the json.
+#
+# The referral names (see matching.py) are different.  Which name a spelling gets folded into depends on what
+# other spellings were around when it was picked, so it isn't something a cache can just remember.  The names
+# picked so far are kept in canonical_names_file instead, and that file is the authority on them: a name once
+# given stays, every later run (full, incremental or streamed) matches new spellings against the names in it
+# first, and the cleaning code changing doesn't touch it.  The same raw sheet with the same names file always
+# cleans the same.  canonical_overrides_file still wins over it, and deleting it picks every name afresh from
+# whatever sheet is cleaned next.
+
+def learned_columns():
+    return [column for column, cleaner in column_cleaners.items() if cleaner.learn]
+
+def load_mappings(mappings_path = mappings_file, names_path = canonical_names_file):
+    mappings = {}
+    if os.path.exists(mappings_path):
+        with open(mappings_path, encoding = 'utf-8') as file:
+            saved = json.load(file)
+        if saved.get('version') == cleaner_version():
+            mappings = {column: {spelling: np.nan if value is None else value for spelling, value in known.items()}
+                        for column, known in saved['columns'].items()}
+    for column in learned_columns():
+        mappings[column] = {'spellings': mappings.pop(column, {}), 'names': {}}
+    if os.path.exists(names_path):
+        with open(names_path, encoding = 'utf-8') as file:
+            for column, names in json.load(file).items():
+                if column in mappings:
+                    mappings[column]['names'] = names
+    return mappings
+
+def save_mappings(mappings, mappings_path = mappings_file, names_path = canonical_names_file):
+    learned = learned_columns()
+    spellings = {column: known.get('spellings', {}) if column in learned else known for column, known in mappings.items()}
+    columns = {column: {spelling: value if isinstance(value, (str, bool)) else None for spelling, value in known.items()}
+               for column, known in spellings.items() if known}
+    with open(mappings_path, 'w', encoding = 'utf-8') as file:
+        json.dump({'version': cleaner_version(), 'columns': columns}, file, indent = 1, sort_keys = True)
+    names = {column: mappings[column]['names'] for column in learned if mappings.get(column, {}).get('names')}
+    with open(names_path, 'w', encoding = 'utf-8') as file:
+        json.dump(names, file, indent = 1, sort_keys = True)
+
+
+# Incremental cleaning.  Most runs only add a week or so of new requests to the bottom of the sheet, so re-cleaning
+# thousands of rows that haven't changed is wasted effort.  Every raw row gets a fingerprint (a hash of its
+# contents), and the fingerprints from the last run are kept in state_file right next to the cleaned files.
+# A row whose fingerprint was seen last time simply reuses its already-cleaned version; everything else goes
+# through clean_data().  Rows are matched by content rather than position, so edits, inserts and deletions in
+# the middle of the sheet are all handled, and the output keeps the raw sheet's row order and index.
+
+def row_fingerprints(raw):
+    # The raw sheet is read as plain text, so this hashes exactly what's in each cell
+    return pd.util.hash_pandas_object(raw, index = False).to_numpy()
+
+def cleaner_version():
+    # If the cleaning code itself changes, every previously cleaned row is suspect, so the code is part of the state.
+    # So are the zip code table and treatment sites the distances are filled in from and the referral name overrides
+    digest = hashlib.sha256()
+    for path in [__file__, cleaners.__file__, validation.__file__, geo.__file__, matching.__file__,
+                 zip_centroids_file, treatment_sites_file, canonical_overrides_file]:
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+def load_state(state_path = state_file):
+    if not os.path.exists(state_path):
+        return None
+    with np.load(state_path, allow_pickle = False) as state:
+        if 'reason_rows' in state.files:
+            reasons = pd.Series(state['reason_text'], index = state['reason_rows'], dtype = object)
+        elif 'reasons' in state.files: # Older states kept a reason ('' or not) for every row
+            reasons = pd.Series(state['reasons'], dtype = object)
+            reasons = reasons[reasons != '']
+        else:
+            reasons = pd.Series(dtype = object)
+        return {'hashes': state['hashes'], 'columns': state['columns'].tolist(), 'version': str(state['version']),
+                'reasons': reasons}
+
+def save_state(raw, hashes, reasons = None, state_path = state_file):
+    # reasons is why each quarantined row was quarantined, by its position in the sheet, so reused rows can be
+    # quarantined again next time.  Only a handful of rows ever fail, so those are the only ones kept
+    reasons = pd.Series(dtype = object) if reasons is None else reasons
+    np.savez(state_path, hashes = hashes, columns = np.array(raw.columns, dtype = str), version = np.array(cleaner_version()),
+             reason_rows = reasons.index.to_numpy(dtype = np.int64), reason_text = reasons.to_numpy(dtype = str))
+
+def row_reasons(quarantine, index, offset = 0):
+    # The reasons from clean_data() for the quarantined rows in index, by their position in it (plus offset)
+    reasons = pd.concat(quarantine) if quarantine else pd.Series(dtype = object)
+    positions = index.get_indexer(reasons.index)
+    return pd.Series(reasons.to_numpy(dtype = object), index = positions + offset, dtype = object).sort_index()
+
+def clean_incremental(raw, hashes, files = None, mappings = None, workers = 1, report = no_report, quarantine = None):
+    # files are the last run's output (see output_files())
+    files = files or output_files()
+    state = load_state(files['state'])
+    cleaned_exists = os.path.exists(files['feather']) or (os.path.exists(files['csv']) and os.path.exists(files['schema']))
+    if state is None or not cleaned_exists or state['version'] != cleaner_version() or state['columns'] != list(raw.columns):
+        print("No usable state from a previous run, cleaning every row")
+        return clean_data(raw.copy(), mappings, workers, report, quarantine)
+
+    with report.stage('read_cleaned') as record:
+        previous = read_cleaned(feather_path = files['feather'], csv_path = files['csv'], schema_path = files['schema'])
+        record['rows'] = len(previous)
+    if len(previous) != len(state['hashes']):
+        print("Cleaned files don't match the saved state, cleaning every row")
+        return clean_data(raw.copy(), mappings, workers, report, quarantine)
+
+    # Where (if anywhere) each raw row's fingerprint sat in the previous cleaned output
+    seen = pd.Series(np.arange(len(state['hashes'])), index = state['hashes'])
+    seen = seen[~seen.index.duplicated()] # Identical raw rows clean identically, so any copy will do
+    source = seen.reindex(hashes).to_numpy()
+    fresh = np.isnan(source)
+
+    print(f"Incremental run: cleaning {fresh.sum()} new or changed rows, reusing {(~fresh).sum()}")
+    if fresh.all():
+        return clean_data(raw.copy(), mappings, workers, report, quarantine)
+
+    reused = previous.iloc[source[~fresh].astype(int)]
+    reused.index = raw.index[~fresh]
+    if quarantine is not None:
+        # Reused rows were validated last time, and their reasons were kept in the state
+        reasons = state['reasons'].reindex(source[~fresh].astype(int)).set_axis(raw.index[~fresh])
+        quarantine.append(reasons.dropna())
+    if not fresh.any():
+        return reused
+
+    # Sorting the index is all it takes to put every row back where the raw sheet has it.  The two halves'
+    # categories won't match, which turns those columns back into plain text, so they get cast once more
+    cleaned = clean_data(raw.loc[fresh].copy(), mappings, workers, report, quarantine)
+    return cast_cleaned(pd.concat([reused, cleaned]).sort_index())
+
+
+# The Support Given cube (see cube.py).  A full run just builds it from scratch, which is nothing next to the
+# cleaning itself.  An incremental run that only added rows to the sheet folds the cube of those new rows into
+# the one from last time.  Anything else (rows edited or deleted, last year's cube, a cube that doesn't belong
+# to the cleaned files on disk) means starting over, since a row can't be taken back out of a min or a max.
+
+def added_rows(hashes, previous_hashes):
+    # Which rows are new since last time, matched by fingerprint and counting duplicates, so a third copy of a
+    # row that used to appear twice is new.  None if any row from last time is missing
+    hashes = pd.Series(hashes)
+    before = pd.Series(previous_hashes).value_counts()
+    if (hashes.value_counts().reindex(before.index, fill_value = 0) < before).any():
+        return None
+    return (hashes.groupby(hashes).cumcount() >= hashes.map(before).fillna(0)).to_numpy()
+
+def update_cube(df, hashes, state, cleaned_version, cube_path = CLEANED_CUBE):
+    # state and cleaned_version describe the last run's output, so they have to be read before it's overwritten
+    year = dt.date.today().year
+    cube = read_cube(cube_path) if os.path.exists(cube_path) else None
+    if (cube is not None and state is not None and state['version'] == cleaner_version()
+            and cube['as_of_year'] == year and cube['version'] == cleaned_version):
+        added = added_rows(hashes, state['hashes'])
+        if added is not None:
+            return merge_cubes(cube, build_cube(df[added], year)) if added.any() else cube
+    return build_cube(df, year)
+
+# Grant Usage's final balances (see balances.py) go the same way, except an incremental run that only added rows
+# works out again just the requestor-years those rows belong to
+
+def update_balance_table(df, hashes, state, cleaned_version, balances_path = CLEANED_BALANCES):
+    if os.path.exists(balances_path) and state is not None and state['version'] == cleaner_version():
+        version, table = read_balances(balances_path)
+        added = added_rows(hashes, state['hashes']) if version == cleaned_version else None
+        if added is not None:
+            return update_balances(table, df, added)
+    return build_balances(df)
+
+# The Trends page's monthly rollup (see trends.py) is kept up the same way as the cube.  It doesn't go stale with
+# the year, and the months an incremental run's new rows fall in are the only ones that change
+
+def update_trends(df, hashes, state, cleaned_version, trends_path = CLEANED_TRENDS):
+    trends = read_trends(trends_path) if os.path.exists(trends_path) else None
+    if (trends is not None and state is not None and state['version'] == cleaner_version()
+            and trends['version'] == cleaned_version):
+        added = added_rows(hashes, state['hashes'])
+        if added is not None:
+            return merge_trends(trends, build_trends(df[added])) if added.any() else trends
+    return build_trends(df)
+
+def previous_cleaned_version(schema_path = CLEANED_SCHEMA):
+    return read_schema(schema_path)['version'] if os.path.exists(schema_path) else None
+
+
+def report_quarantine(count, quarantine_path = CLEANED_QUARANTINE):
+    if count:
+        print(f"{count} rows broke a validation rule, they're in '{quarantine_path}' with the reasons")
+
+
+# Streaming cleaning.  For exports too big to comfortably hold in memory (several times over, once all the
+# intermediate copies the cleaning makes are counted), the raw file is read chunksize rows at a time and each
+# chunk is cleaned and written out before the next one is read.  Every step in clean_data() only looks at its
+# own row and the raw file is read as text either way, so the result is exactly what a full run produces;
+# only a chunk's worth of rows (plus 8 bytes per row of fingerprints for the state file) is ever held.
+
+def report_chunks(chunks, report):
+    # Reading happens inside the for loop's next(), so this is what lets read time show up in the report
+    chunks = iter(chunks)
+    while True:
+        with report.stage('read_raw') as record:
+            chunk = next(chunks, None)
+            record['rows'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+def learn_whole_columns(path, chunksize, mappings):
+    # The referral names (see matching.py) are picked from how often each spelling turns up, so a chunk that
+    # happened to have JUILE DRAGOO before JULIE DRAGOO would make the typo the name.  A first pass over just
+    # those columns shows their cleaners every spelling at once, the same as a full run does, and after that
+    # each chunk only looks them up in mappings
+    columns = {column: cleaner.source or column for column, cleaner in column_cleaners.items() if cleaner.learn}
+    counts = {column: [] for column in columns}
+    for chunk in read_raw(path, chunksize, list(dict.fromkeys(columns.values()))):
+        for column, source in columns.items():
+            counts[column].append(chunk[source].value_counts())
+    for column in columns:
+        # Only the distinct spellings and how many rows have each, however long the file is
+        spellings = pd.concat(counts[column]).groupby(level = 0).sum()
+        column_cleaners[column].learn(spellings.index, spellings.to_numpy(), mappings.setdefault(column, {}))
+
+def clean_streaming(chunksize, path = dataset, files = None, mappings = None, workers = 1, report = no_report,
+                    measure_memory = False):
+    # Hands back the memory use of every column, added up over the chunks, if measure_memory is set
+    files = files or output_files()
+    mappings = {} if mappings is None else mappings
+    with report.stage('learn_whole_columns'):
+        learn_whole_columns(path, chunksize, mappings)
+    writer = CleanedWriter(files['csv'], files['feather'], files['schema'])
+    hashes = []
+    cube = None
+    balances = None
+    trends = None
+    memory = None
+    quarantine = []
+    quarantined = [] # The raw rows that go with quarantine, since each chunk is gone once it's done
+    reasons = [] # Only the quarantined rows', by their position in the whole sheet
+    rows = 0
+    for chunk in report_chunks(read_raw(path, chunksize), report):
+        with report.stage('row_fingerprints'):
+            hashes.append(row_fingerprints(chunk))
+        cleaned = clean_data(chunk, mappings, workers, report, quarantine) # Spellings found in one chunk are free in every later one
+        quarantined.append(chunk.loc[quarantine[-1].index])
+        reasons.append(row_reasons(quarantine[-1:], chunk.index, rows))
+        rows += len(chunk)
+        with report.stage('write_cleaned') as record:
+            writer.write(cleaned)
+            record['rows'] = len(cleaned)
+        with report.stage('build_cube'):
+            chunk_cube = build_cube(cleaned)
+            cube = chunk_cube if cube is None else merge_cubes(cube, chunk_cube)
+        with report.stage('build_balances'):
+            chunk_balances = build_balances(cleaned)
+            balances = chunk_balances if balances is None else merge_balances(balances, chunk_balances)
+        with report.stage('build_trends'):
+            chunk_trends = build_trends(cleaned)
+            trends = chunk_trends if trends is None else merge_trends(trends, chunk_trends)
+        if measure_memory:
+            memory = add_memory(memory, column_memory(cleaned))
+    with report.stage('write_cleaned'):
+        schema = writer.close()
+    with report.stage('write_cube'):
+        write_cube({**cube, 'version': schema['version']}, files['cube'])
+    with report.stage('write_balances'):
+        write_balances(balances, schema['version'], files['balances'])
+    with report.stage('write_trends'):
+        write_trends({**trends, 'version': schema['version']}, files['trends'])
+    with report.stage('write_quarantine'):
+        count = write_quarantine(pd.concat(quarantined), pd.concat(quarantine), files['quarantine'])
+    with report.stage('save_state'):
+        save_state(chunk, np.concatenate(hashes), pd.concat(reasons), files['state'])
+    report_quarantine(count, files['quarantine'])
+    return memory
+
+
+def sheet_text(value):
+    # How the sheet itself would spell a value pandas already read as something else: a zip column with a blank
+    # in it comes back as floats (68507.0), the Yes/No columns as True/False and the dates as Timestamps
+    if isinstance(value, (bool, np.bool_)):
+        return 'Yes' if value else 'No'
+    if isinstance(value, (dt.date, np.datetime64)):
+        return pd.Timestamp(value).strftime('%m/%d/%Y')
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+def as_sheet_text(column):
+    # Each distinct value is spelled once, the same trick as apply_steps() in cleaners.py
+    codes, values = pd.factorize(column)
+    text = np.empty(len(values) + 1, dtype = object)
+    text[:-1] = [sheet_text(value) for value in values]
+    text[-1] = np.nan
+    return pd.Series(text[codes], index = column.index, dtype = object)
+
+def clean(frame, mappings = None, workers = 1):
+    # The cleaning on its own, for anyone importing this: the raw sheet as a frame in, the cleaned frame out, and
+    # nothing read from or written to disk.  The raw values are meant to be text, the way read_raw() hands them
+    # back.  Anything else is spelled the way the sheet would have it first (see sheet_text()), so a frame
+    # straight from pd.read_csv or pd.read_excel cleans the same as the text would.  Columns that aren't there
+    # are just left out.  mappings is a dict to share what every spelling cleaned up to between calls, like
+    # load_mappings() does between runs
+    raw = frame.apply(as_sheet_text).astype(object)
+    return clean_data(raw, {} if mappings is None else mappings, workers)
+
+
+def main(argv = None):
+    import argparse
+    parser = argparse.ArgumentParser(description = "Clean the Hope Foundation grant data set")
+    parser.add_argument('--input', default = dataset, metavar = 'PATH',
+                        help = "the raw sheet, as a .csv export or the .xlsx workbook itself (default: %(default)s)")
+    parser.add_argument('--output', default = CLEANED_CSV, metavar = 'PATH',
+                        help = "the cleaned csv; everything else the run writes goes next to it, named after it (default: %(default)s)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--incremental', action = 'store_true',
+                      help = "only clean rows that are new or changed since the last run")
+    mode.add_argument('--chunksize', type = int, metavar = 'ROWS',
+                      help = "stream the raw file through the cleaning this many rows at a time")
+    parser.add_argument('--workers', type = int, default = 1, metavar = 'N',
+                        help = "clean columns in N processes at once (0 means one per core, default 1)")
+    parser.add_argument('--report', metavar = 'PATH',
+                        help = "write a per-stage run report (time, memory, blanks, changes) to PATH (.json or .csv)")
+    parser.add_argument('--no-memory', action = 'store_true',
+                        help = "leave memory out of the report (tracking it slows the run down)")
+    parser.add_argument('--profile', metavar = 'DIR',
+                        help = "cProfile every stage and keep the dumps for the slowest ones in DIR")
+    parser.add_argument('--profile-top', type = int, default = 3, metavar = 'N',
+                        help = "how many of the slowest stages to keep cProfile dumps for (default 3)")
+    parser.add_argument('--memory-report', metavar = 'PATH',
+                        help = "write every cleaned column's memory use, compact types vs plain ones, to PATH (.json or .csv)")
+    parser.add_argument('--budgets', metavar = 'PATH',
+                        help = "json file of per-stage time and null-rate budgets; the run fails if one is blown")
+    args = parser.parse_args(argv)
+    workers = args.workers or os.cpu_count()
+
+    instrumented = args.report or args.profile or args.budgets
+    report = RunReport(trace_memory = not args.no_memory, profile = bool(args.profile)) if instrumented else no_report
+
+    files = output_files(args.output)
+    mappings = load_mappings(files['mappings'], files['canonical'])
+
+    if args.chunksize:
+        memory = clean_streaming(args.chunksize, args.input, files, mappings = mappings, workers = workers, report = report,
+                                 measure_memory = bool(args.memory_report))
+    else:
+        with report.stage('read_raw') as record:
+            raw = read_raw(args.input)
+            record['rows'] = len(raw)
+        with report.stage('row_fingerprints'):
+            hashes = row_fingerprints(raw)
+        previous_state, previous_version = load_state(files['state']), previous_cleaned_version(files['schema'])
+
+        quarantine = []
+        if args.incremental:
+            df = clean_incremental(raw, hashes, files, mappings = mappings, workers = workers, report = report, quarantine = quarantine)
+        else:
+            df = clean_data(raw.copy(), mappings, workers, report, quarantine)
+
+        # Write to new and squeaky clean files.  The csv is still there for anyone who wants to open it in Excel,
+        # but the dashboard reads the feather file (plus its schema sidecar) so it doesn't have to re-guess every type
+        with report.stage('build_cube'):
+            cube = update_cube(df, hashes, previous_state, previous_version, files['cube']) if args.incremental else build_cube(df)
+        with report.stage('build_balances'):
+            balances = update_balance_table(df, hashes, previous_state, previous_version, files['balances']) if args.incremental else build_balances(df)
+        with report.stage('build_trends'):
+            trends = update_trends(df, hashes, previous_state, previous_version, files['trends']) if args.incremental else build_trends(df)
+        with report.stage('write_cleaned') as record:
+            schema = write_cleaned(df, files['csv'], files['feather'], files['schema'])
+            record['rows'] = len(df)
+        with report.stage('write_cube'):
+            write_cube({**cube, 'version': schema['version']}, files['cube']) # Ties the cube to the files it was built from
+        with report.stage('write_balances'):
+            write_balances(balances, schema['version'], files['balances'])
+        with report.stage('write_trends'):
+            write_trends({**trends, 'version': schema['version']}, files['trends'])
+        with report.stage('write_quarantine'):
+            count = write_quarantine(raw, pd.concat(quarantine).sort_index(), files['quarantine'])
+        with report.stage('save_state'):
+            # Saved on full runs too, so the next incremental run has something to start from
+            save_state(raw, hashes, row_reasons(quarantine, raw.index), files['state'])
+        report_quarantine(count, files['quarantine'])
+        memory = column_memory(df) if args.memory_report else None
+    with report.stage('save_mappings'):
+        save_mappings(mappings, files['mappings'], files['canonical'])
+
+    if args.report:
+        report.write(args.report)
+    if args.memory_report:
+        total = write_memory_report(memory, args.memory_report)
+        print(f"Cleaned data takes {total['bytes_after'] / 2**20:.2f} MB in memory, down from {total['bytes_before'] / 2**20:.2f} MB")
+    if args.profile:
+        for path in report.dump_profiles(args.profile, args.profile_top):
+            print(f"Profile written to {path}")
+    if args.budgets:
+        broken = report.check_budgets(load_budgets(args.budgets))
+        if broken:
+            sys.exit("Stage budgets exceeded:\n  " + "\n  ".join(broken))
+
+
+if __name__ == "__main__":
+    main()
+
+# Well. . . That was exhausting and terribly inefficient.  Time to make the dashboard
@@ -0,0 +1,133 @@
+import csv
+import difflib
+import math
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+
+# Folding near-duplicate spellings of the same clinic or person (JULIE DRAGOO and JUILE DRAGOO, KELLIE STERKEL
+# and KELLIE STERKEL-SW) into one, for Referral Source and Referred By:.  See canonical() in cleaners.py for
+# where it's used.
+#
+# Only distinct spellings are ever compared, never rows.  Each one is first boiled down to a key (upper case,
+# punctuation and anything in brackets gone, and for people their credentials and job titles too), and equal
+# keys are the same thing.  Beyond that, spellings are taken most common first: each one joins the closest
+# name already picked if it's at least match_ratio alike (difflib's ratio, about one wrong letter in ten),
+# and otherwise becomes a name of its own for the rest to be matched against.
+#
+# Comparing every spelling with every other one would take forever once there are tens of thousands, so the
+# names are kept in an index from each three-letter piece (trigram) to the names containing it.  Two keys
+# that alike share at least half their trigrams, so any n // 2 + 1 of a key's n trigrams are certain to
+# include one they share; looking up just the rarest of them finds every name worth comparing without
+# wading through the common ones (' MA', 'ER ').  Keys shorter than min_fuzzy_length (initials like LM, AJS
+# and TG) only ever match exactly, since one letter is all that tells them apart.
+
+match_ratio = 0.9
+min_overlap = 0.5
+min_fuzzy_length = 6
+
+# Credentials and job titles tacked onto people's names, which say nothing about who they are
+person_titles = ['ONCOLOGY SOCIAL WORKER', 'SOCIAL WORKER', 'NURSE NAVIGATOR', 'CANCER PROGRAM MANAGER',
+                 'MD', 'DR', 'RN', 'MSW', 'LICSW', 'LADC', 'OSW', 'SW', 'ONN']
+person_title_pattern = re.compile(r'\b(?:' + '|'.join(person_titles) + r')\b')
+
+
+def name_key(text, people = False):
+    key = re.sub(r'\([^)]*\)', ' ', text.upper())
+    key = re.sub(r"[^\w/&]+", ' ', key)
+    if people:
+        key = person_title_pattern.sub(' ', re.sub(r'\bM D\b', 'MD', key))
+    return ' '.join(key.split())
+
+def trigrams(key):
+    padded = f" {key} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+class NameIndex:
+    # postings are keyed by trigram and key length.  difflib's ratio is 2 * matched / (both lengths added up),
+    # and at most the shorter key can match, so an n letter key can only be match_ratio alike with keys from
+    # n * r / (2 - r) to n * (2 - r) / r letters long (r being match_ratio, so from about 0.82 n to 1.22 n
+    # at 0.9).  Names outside that never need looking at
+    def __init__(self):
+        self.names = [] # (key, its trigrams, canonical spelling)
+        self.exact = {}
+        self.postings = defaultdict(list)
+
+    def add(self, key, name):
+        self.exact.setdefault(key, name)
+        if len(key) < min_fuzzy_length:
+            return
+        position = len(self.names)
+        pieces = trigrams(key)
+        self.names.append((key, pieces, name))
+        for trigram in pieces:
+            self.postings[trigram, len(key)].append(position)
+
+    def match(self, key):
+        # The canonical spelling key belongs with, or None if it's new
+        if key in self.exact:
+            return self.exact[key]
+        if len(key) < min_fuzzy_length:
+            return None
+        lengths = range(math.ceil(len(key) * match_ratio / (2 - match_ratio)), math.floor(len(key) * (2 - match_ratio) / match_ratio) + 1)
+        pieces = trigrams(key)
+        overlap = math.ceil(min_overlap * len(pieces))
+        postings = {trigram: [self.postings[trigram, length] for length in lengths if (trigram, length) in self.postings]
+                    for trigram in pieces}
+        prefix = sorted(pieces, key = lambda trigram: sum(map(len, postings[trigram])))[:len(pieces) - overlap + 1]
+        candidates = set().union(*(positions for trigram in prefix for positions in postings[trigram]))
+
+        # Counting the trigrams really shared is cheap next to difflib, and throws out nearly every candidate
+        best, best_ratio = None, match_ratio
+        for position in candidates:
+            other, other_pieces, name = self.names[position]
+            if len(pieces & other_pieces) < overlap:
+                continue
+            matcher = difflib.SequenceMatcher(None, key, other, autojunk = False)
+            if matcher.quick_ratio() >= best_ratio and matcher.ratio() >= best_ratio:
+                best, best_ratio = name, matcher.ratio()
+        return best
+
+
+def canonicalize(spellings, counts, names = (), people = False, overrides = None):
+    # spellings are distinct cleaned spellings and counts how many rows have each.  names are the canonical
+    # names already in use from earlier runs, which new spellings are matched against first, so an answer once
+    # given never changes.  Hands back each spelling's canonical name
+    overrides = overrides or {}
+    index = NameIndex()
+    for spelling, name in overrides.items():
+        index.add(name_key(spelling, people), name)
+    for name in names:
+        index.add(name_key(name, people), name)
+
+    canonical = {}
+    for position in np.lexsort((np.array(spellings, dtype = str), -np.asarray(counts))):
+        spelling = spellings[position]
+        key = name_key(spelling, people)
+        if spelling in overrides:
+            canonical[spelling] = overrides[spelling]
+        elif not key:
+            canonical[spelling] = spelling # Nothing left once the titles are gone ('SOCIAL WORKER'), so it stands alone
+        else:
+            canonical[spelling] = index.match(key)
+            if canonical[spelling] is None:
+                canonical[spelling] = spelling
+                index.add(key, spelling)
+    return canonical
+
+
+# The override file is for the pairs no spelling rule could know about (NEBRASKA CANCER SPECIALIST is NCS),
+# or to pull apart two names that were folded together.  It's a csv so it can be kept in Excel: one row per
+# spelling, with the column it's in, the spelling as it comes out of the cleaning rules, and what it should be
+
+def load_overrides(path):
+    overrides = {}
+    if not os.path.exists(path):
+        return overrides
+    with open(path, newline = '', encoding = 'utf-8') as file:
+        for row in csv.DictReader(file):
+            overrides.setdefault(row['column'], {})[row['spelling']] = row['canonical']
+    return overrides
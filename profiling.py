@@ -0,0 +1,220 @@
+import contextlib
+import json
+import os
+import re
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Instrumentation for main.py.  Each step of a cleaning run (reading the sheet, every column in the cleaning
+# table, validation, writing the files...) is wrapped in report.stage(), which records:
+#
+#   seconds           wall time
+#   memory_peak_mb    how far memory climbed above where it was when the stage started (via tracemalloc,
+#                     which numpy and pandas report their allocations to)
+#   rows              rows the stage looked at
+#   nulls_introduced  blanks in the output that weren't blanks going in
+#   values_changed    non-blank cells that came out different from how they went in (left blank for the
+#                     columns worked out from other cleaned columns, see record_changes())
+#
+# Stages that run more than once (every chunk in a streaming run) are added together under the one name.
+# A disabled RunReport (the default everywhere) still hands out stage records but measures nothing, so the
+# cleaning code can call it unconditionally.
+
+class RunReport:
+    def __init__(self, enabled = True, trace_memory = True, profile = False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.profile = enabled and profile
+        self.started = datetime.now().isoformat(timespec = 'seconds')
+        self.stages = {}
+        self.profiles = {}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = {'rows': None, 'nulls_introduced': None, 'values_changed': None}
+        if not self.enabled:
+            yield record
+            return
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        profiler = None
+        if self.profile:
+            import cProfile # Only runs with --profile need it
+            profiler = cProfile.Profile()
+        if profiler is not None:
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self.profiles.setdefault(name, []).append(profiler)
+            peak = (tracemalloc.get_traced_memory()[1] - memory_before) / 2**20 if self.trace_memory else None
+            self.add(name, seconds, peak, record)
+
+    def add(self, name, seconds, memory_peak_mb, record):
+        # The record is kept rather than copied, since the counts often get filled in after the stage has ended
+        # (working them out shouldn't count towards its time)
+        total = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'seconds': 0.0, 'memory_peak_mb': None, 'records': []})
+        total['calls'] += 1
+        total['seconds'] += seconds
+        if memory_peak_mb is not None:
+            total['memory_peak_mb'] = max(total['memory_peak_mb'] or 0.0, memory_peak_mb)
+        total['records'].append(record)
+
+    def rows(self):
+        for total in self.stages.values():
+            row = {key: value for key, value in total.items() if key != 'records'}
+            for key in ['rows', 'nulls_introduced', 'values_changed']:
+                counts = [int(record[key]) for record in total['records'] if record[key] is not None]
+                row[key] = sum(counts) if counts else None
+            row['null_rate'] = row['nulls_introduced'] / row['rows'] if row['rows'] and row['nulls_introduced'] is not None else None
+            yield row
+
+    def write(self, path):
+        # A .csv path gets one line per stage, anything else gets json with a little about the run on top
+        records = list(self.rows())
+        if path.lower().endswith('.csv'):
+            pd.DataFrame(records).to_csv(path, index = False)
+        else:
+            with open(path, 'w', encoding = 'utf-8') as file:
+                json.dump({'started': self.started, 'total_seconds': sum(record['seconds'] for record in records),
+                           'stages': records}, file, indent = 2)
+
+    def dump_profiles(self, directory, top = 3):
+        # cProfile output (readable with pstats or snakeviz) for the slowest few stages only
+        import pstats
+        os.makedirs(directory, exist_ok = True)
+        slowest = sorted(self.stages.values(), key = lambda record: record['seconds'], reverse = True)[:top]
+        written = []
+        for record in slowest:
+            path = os.path.join(directory, re.sub(r'[^\w.-]+', '_', record['stage']).strip('_') + '.prof')
+            profilers = self.profiles.get(record['stage'], [])
+            if profilers:
+                pstats.Stats(*profilers).dump_stats(path)
+                written.append(path)
+        return written
+
+    def check_budgets(self, budgets):
+        # budgets looks like {"default": {"seconds": 10, "null_rate": 0.5}, "stages": {"clean: DOB": {"seconds": 1}}}.
+        # A stage's own entry wins over the default, key by key
+        broken = []
+        default = budgets.get('default', {})
+        for record in self.rows():
+            limits = {**default, **budgets.get('stages', {}).get(record['stage'], {})}
+            if 'seconds' in limits and record['seconds'] > limits['seconds']:
+                broken.append(f"{record['stage']} took {record['seconds']:.3f}s (budget {limits['seconds']}s)")
+            if 'null_rate' in limits and record['null_rate'] is not None and record['null_rate'] > limits['null_rate']:
+                broken.append(f"{record['stage']} blanked {record['null_rate']:.1%} of its rows (budget {limits['null_rate']:.1%})")
+        return broken
+
+
+# The spellings of yes and no the flag cleaners in main.py take, lower case
+flag_spellings = {'true': True, 'yes': True, 'y': True, 'false': False, 'no': False, 'n': False}
+
+def read_as(values, like):
+    # values read as the same type as like, so only a cell whose value really moved compares unequal.  Each
+    # distinct date is parsed once, the same as the cleaning does it
+    if pd.api.types.is_bool_dtype(like.dtype):
+        return values.astype(str).str.strip().str.lower().map(flag_spellings).to_numpy(dtype = object)
+    if pd.api.types.is_numeric_dtype(like.dtype):
+        return pd.to_numeric(values, errors = 'coerce').to_numpy(dtype = float, na_value = np.nan)
+    if pd.api.types.is_datetime64_any_dtype(like.dtype):
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            return values.to_numpy(dtype = 'datetime64[ns]')
+        codes, uniques = pd.factorize(values.astype(str))
+        return pd.to_datetime(pd.Series(uniques), format = 'mixed', errors = 'coerce').to_numpy(dtype = 'datetime64[ns]')[codes]
+    return values.astype(str).to_numpy()
+
+def comparable(values):
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values.astype(object).to_numpy()
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.to_numpy(dtype = float, na_value = np.nan)
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.to_numpy(dtype = 'datetime64[ns]')
+    return values.astype(str).to_numpy()
+
+def record_changes(record, before, after):
+    # before and after are the same rows going into and coming out of a stage.  A cleaner's output is usually a
+    # different type to the raw text it read, so before is read as after's type first: '1' going to 1.0, or
+    # '10/17/2018' going to 2018-10-17, isn't a change, while ' $1,234 ' going to 1234.0 is.
+    #
+    # before is a tuple of columns for the stages worked out from other cleaned columns (YOB from DOB).  A year
+    # was never a date to begin with, so there's no counting changes, and a blank only counts as introduced if
+    # none of the columns it came from were blank already
+    if isinstance(before, tuple):
+        before_blank = np.logical_or.reduce([values.isna().to_numpy() for values in before])
+    else:
+        before_blank = before.isna().to_numpy()
+    after_blank = after.isna().to_numpy()
+    record['rows'] = len(after)
+    record['nulls_introduced'] = int((after_blank & ~before_blank).sum())
+    if isinstance(before, tuple):
+        record['values_changed'] = None
+    else:
+        both = ~before_blank & ~after_blank
+        record['values_changed'] = int((read_as(before[both], after[both]) != comparable(after[both])).sum())
+    return record
+
+
+# Memory.  column_memory() says how many bytes every column of a cleaned frame takes as stored (the compact
+# types in main.py's cleaned_dtypes) next to what it took with the plain types it used to get: text as Python
+# strings, whole numbers as Int64 and every other number as float64.  Strings are counted in full (deep=True),
+# since they're the bulk of it.  Chunks of a streaming run add up with add_memory()
+
+def wide_dtype(dtype):
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'object'
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in 'iu':
+        return 'Int64'
+    if dtype == 'float32':
+        return 'float64'
+    return dtype
+
+def column_memory(df):
+    wide = df.astype({column: wide_dtype(dtype) for column, dtype in df.dtypes.items()})
+    return pd.DataFrame({
+        'dtype_before': wide.dtypes.astype(str),
+        'dtype_after': df.dtypes.astype(str),
+        'bytes_before': wide.memory_usage(deep = True, index = False),
+        'bytes_after': df.memory_usage(deep = True, index = False)
+    }).rename_axis('column')
+
+def add_memory(memory, more):
+    if memory is None:
+        return more
+    return memory.assign(bytes_before = memory['bytes_before'] + more['bytes_before'],
+                         bytes_after = memory['bytes_after'] + more['bytes_after'])
+
+def write_memory_report(memory, path):
+    # One line per column plus a total, as .csv or (anything else) json.  Hands back the total line
+    memory = memory.assign(saved = 1 - memory['bytes_after'] / memory['bytes_before'].where(memory['bytes_before'] > 0))
+    before, after = int(memory['bytes_before'].sum()), int(memory['bytes_after'].sum())
+    total = {'column': 'TOTAL', 'bytes_before': before, 'bytes_after': after, 'saved': 1 - after / before if before else None}
+    rows = [{'column': column, **record} for column, record in memory.iterrows()] + [total]
+    if path.lower().endswith('.csv'):
+        pd.DataFrame(rows).to_csv(path, index = False)
+    else:
+        with open(path, 'w', encoding = 'utf-8') as file:
+            json.dump(rows, file, indent = 2, default = lambda value: value.item())
+    return total
+
+
+def load_budgets(path):
+    with open(path, encoding = 'utf-8') as file:
+        return json.load(file)
+
+
+# What everything gets when nobody asked for a report
+no_report = RunReport(enabled = False)
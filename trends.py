@@ -0,0 +1,195 @@
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from datastore import CLEANED_TRENDS
+
+# The Trends page shows how requests, money paid out, approvals and waiting times move from month to month, for
+# every Type of Assistance.  Grouping the whole history by month on every click would get slower every month,
+# so main.py keeps a small rollup instead: one row per month and type with the number of requests, how many of
+# them have been decided (approved or denied), how many were approved, how many were paid and the total paid.
+# All of those add up across batches of rows, the same as the cube (see cube.py), so an incremental run only
+# builds a rollup of the new rows and adds it onto the months they fall in.
+#
+# A median doesn't add up like that, so the days from request to payment are kept as a histogram instead (days
+# -> how many payments took that long).  Those do add up, and the median read off one is exactly the median of
+# the rows it came from.  The 3 and 12 month rolling windows are kept the same way, one row per type for every
+# month a window ends on, and since those add up just the same a merge only adds the new rows' share onto them.
+#
+# Every month also gets an 'All types' row, so the page never has to add types together itself.
+
+date_column = 'Grant Req Date'
+type_column = 'Type of Assistance (CLASS)'
+status_column = 'Request Status'
+amount_column = ' Amount '
+days_column = 'days_request_to_payment'
+
+# The columns build_trends() needs from the cleaned data
+trend_source_columns = [date_column, type_column, status_column, amount_column, days_column]
+
+all_types = 'All types'
+windows = [3, 12] # Months in each rolling window, counting the month it ends on
+
+statistics = ['requests', 'decided', 'approved', 'paid', 'amount']
+
+
+def month_rows(df):
+    # Every row once under its own type and once under all_types.  Rows without a date can't be placed in a
+    # month, and rows without a type only count towards all_types
+    dated = df.loc[df[date_column].notna()]
+    months = dated[date_column].dt.to_period('M')
+    types = dated[type_column].astype(object)
+    frame = pd.DataFrame({
+        'month': months,
+        'requests': 1,
+        'decided': dated[status_column].isin(['Approved', 'Denied']).to_numpy(),
+        'approved': (dated[status_column] == 'Approved').to_numpy(),
+        'paid': dated[amount_column].notna().to_numpy(),
+        'amount': dated[amount_column].fillna(0).to_numpy(dtype = float),
+        'days': dated[days_column].astype('Int64')
+    }, index = dated.index)
+    return pd.concat([frame.assign(type = types), frame.assign(type = all_types)]).dropna(subset = ['type'])
+
+def add_waits(waits):
+    # Adds up any number of days -> count histograms
+    total = Counter()
+    for histogram in waits:
+        total.update(histogram)
+    return dict(sorted(total.items()))
+
+def add_up(table):
+    # Folds rows with the same month and type together
+    grouped = table.groupby(level = ['month', 'type'], sort = True)
+    totals = grouped[statistics].sum().round({'amount': 2}) # To the cent, so adding up in a different order can't change it
+    return totals.assign(waits = pd.Series([add_waits(waits) for _, waits in grouped['waits']], index = totals.index, dtype = object))
+
+def build_monthly(df):
+    rows = month_rows(df)
+    grouped = rows.groupby(['month', 'type'], sort = True)
+    monthly = grouped[statistics].sum().astype({'requests': 'int64', 'decided': 'int64', 'approved': 'int64', 'paid': 'int64'}).round({'amount': 2})
+    waits = rows.dropna(subset = ['days']).groupby(['month', 'type', 'days']).size()
+    histograms = {key: {} for key in monthly.index}
+    for (month, kind, days), count in waits.items():
+        histograms[(month, kind)][int(days)] = int(count)
+    return monthly.assign(waits = pd.Series([histograms[key] for key in monthly.index], index = monthly.index, dtype = object))
+
+def window_rows(monthly, size, first, last):
+    # Adds up the window of size months ending on every month from first to last.  Each window is just the
+    # monthly rows shifted forward by 0 to size - 1 months and added up, so every row that lands in one is
+    # repeated once per offset and the lot is grouped by the month it ends on
+    months = monthly.index.get_level_values('month')
+    needed = monthly.loc[(months > first - size) & (months <= last)]
+    ordinals = np.repeat(needed.index.get_level_values('month').asi8, size) + np.tile(np.arange(size), len(needed))
+    keep = (ordinals >= first.ordinal) & (ordinals <= last.ordinal)
+    positions = np.repeat(np.arange(len(needed)), size)[keep]
+    shifted = needed.iloc[positions].set_axis(pd.MultiIndex.from_arrays(
+        [pd.PeriodIndex.from_ordinals(ordinals[keep], freq = 'M'), needed.index.get_level_values('type')[positions]],
+        names = ['month', 'type']))
+    return add_up(shifted)
+
+def rolling_windows(monthly):
+    # One row per type for every month a window with anything in it ends on, up to the last month there is
+    if monthly.empty:
+        return {size: monthly.copy() for size in windows}
+    months = monthly.index.get_level_values('month')
+    return {size: window_rows(monthly, size, months.min(), months.max()) for size in windows}
+
+def fold(table, addition):
+    # Adds addition's rows onto table's.  Only the month and type pairs addition has are touched
+    both = add_up(pd.concat([table.loc[table.index.isin(addition.index)], addition]))
+    return pd.concat([table.loc[~table.index.isin(addition.index)], both]).sort_index()
+
+def build_trends(df, version = None):
+    monthly = build_monthly(df)
+    return {'version': version, 'monthly': monthly, 'rolling': rolling_windows(monthly)}
+
+def merge_trends(trends, addition):
+    # Folds addition (the rollup of some new rows) into trends.  The windows add up too, so the new rows' share
+    # of every window up to the old last month is worked out from addition alone and added on.  Windows ending on
+    # a month past that are new, and are worked out from the merged months
+    old, new = trends['monthly'], addition['monthly']
+    if new.empty:
+        return trends
+    if old.empty:
+        return {**trends, 'monthly': new, 'rolling': addition['rolling']}
+    monthly = fold(old, new)
+
+    new_months = new.index.get_level_values('month')
+    old_last = old.index.get_level_values('month').max()
+    last = monthly.index.get_level_values('month').max()
+    rolling = {}
+    for size, table in trends['rolling'].items():
+        if new_months.min() <= old_last:
+            table = fold(table, window_rows(new, size, new_months.min(), old_last))
+        if last > old_last:
+            table = pd.concat([table, window_rows(monthly, size, old_last + 1, last)]).sort_index()
+        rolling[size] = table
+    return {**trends, 'monthly': monthly, 'rolling': rolling}
+
+def median_days(histogram):
+    # The same as the median of the rows the histogram counts: the middle one, or halfway between the middle two
+    if not histogram:
+        return np.nan
+    days = np.array(list(histogram.keys()), dtype = float)
+    counts = np.cumsum(list(histogram.values()))
+    total = counts[-1]
+    low = days[np.searchsorted(counts, (total - 1) // 2, side = 'right')]
+    high = days[np.searchsorted(counts, total // 2, side = 'right')]
+    return (low + high) / 2
+
+def trend_table(trends, assistance = all_types, window = 1):
+    # What the page actually draws for one type: a row per month (window 1) or per month a rolling window ends on
+    table = trends['monthly'] if window == 1 else trends['rolling'][window]
+    if assistance not in table.index.get_level_values('type'):
+        return pd.DataFrame(columns = ['Requests', 'Amount Paid', 'Approval Rate', 'Median Days to Payment'], dtype = float)
+    table = table.xs(assistance, level = 'type')
+    return pd.DataFrame({
+        'Requests': table['requests'],
+        'Amount Paid': table['amount'],
+        'Approval Rate': table['approved'] / table['decided'].where(table['decided'] > 0),
+        'Median Days to Payment': table['waits'].map(median_days).astype(float)
+    }).set_axis(table.index.to_timestamp()) # Dates, so the charts space the months out properly
+
+def trend_types(trends):
+    # all_types first, then every type in alphabetical order
+    types = trends['monthly'].index.get_level_values('type').unique()
+    return [all_types, *sorted(kind for kind in types if kind != all_types)]
+
+
+# Saved as json, the same way as the cube.  Months are 'YYYY-MM' and each histogram is a list of [days, count]
+
+def table_to_json(table):
+    return {
+        'months': [str(month) for month in table.index.get_level_values('month')],
+        'types': list(table.index.get_level_values('type')),
+        **{statistic: table[statistic].tolist() for statistic in statistics},
+        'waits': [[[days, count] for days, count in histogram.items()] for histogram in table['waits']]
+    }
+
+def table_from_json(columns):
+    index = pd.MultiIndex.from_arrays([pd.PeriodIndex(columns['months'], freq = 'M'), pd.Index(columns['types'], dtype = object)],
+                                      names = ['month', 'type'])
+    table = pd.DataFrame({statistic: pd.Series(columns[statistic], dtype = float) for statistic in statistics})
+    table = table.astype({'requests': 'int64', 'decided': 'int64', 'approved': 'int64', 'paid': 'int64'})
+    table['waits'] = pd.Series([dict(pairs) for pairs in columns['waits']], dtype = object)
+    table.index = index
+    return table
+
+def write_trends(trends, trends_path = CLEANED_TRENDS):
+    with open(trends_path, 'w', encoding = 'utf-8') as file:
+        json.dump({
+            'version': trends['version'],
+            'monthly': table_to_json(trends['monthly']),
+            'rolling': {str(size): table_to_json(table) for size, table in trends['rolling'].items()}
+        }, file)
+
+def read_trends(trends_path = CLEANED_TRENDS):
+    with open(trends_path, encoding = 'utf-8') as file:
+        saved = json.load(file)
+    return {
+        'version': saved['version'],
+        'monthly': table_from_json(saved['monthly']),
+        'rolling': {int(size): table_from_json(table) for size, table in saved['rolling'].items()}
+    }
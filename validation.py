@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from datastore import CLEANED_QUARANTINE
+
+# The checks that run once every column is cleaned: values that read fine on their own but can't be right
+# (a household of 4,602, a birthday after the request it's on, a payment made before it was asked for).
+#
+# Each rule says which cell it's about, what makes it wrong, and what to do about it, which is blanking just
+# that cell unless the rule knows the right value.  They used to be one-off fixes spread through main.py, and
+# the household one blanked the entire row, grant amounts and all, to get rid of one bad number.  Now every
+# rule is checked in the same pass, each one as a single comparison over the whole column, and any row that
+# broke one is copied (as it was in the raw sheet) to the quarantine file along with why, so someone can fix
+# the sheet itself.
+#
+# Every rule is checked against the frame as it came in, before anything is fixed, so the order they're
+# written in doesn't matter and a row that breaks two of them lists both.
+
+class Rule:
+    def __init__(self, column, reason, failing, fix = None, needs = ()):
+        self.column = column # The cell that gets fixed
+        self.needs = needs # Any other columns it's checked against
+        self.reason = reason # What the quarantine file says about it
+        self.failing = failing # Takes the cleaned and raw frames, hands back True for every row that breaks the rule
+        self.fix = fix # Takes the same plus those rows, hands back their fixed values.  None blanks them
+
+
+def known(mask):
+    # Comparisons with a blank on either side don't break anything
+    return pd.Series(mask).to_numpy(dtype = bool, na_value = False)
+
+def limit(value):
+    return value() if callable(value) else value
+
+def in_range(column, reason, low = None, high = None):
+    # low and high are inclusive, and either can be a function (pd.Timestamp.today) to be worked out at check time
+    def failing(df, raw):
+        values = df[column]
+        outside = np.zeros(len(df), dtype = bool)
+        if low is not None:
+            outside |= known(values < limit(low))
+        if high is not None:
+            outside |= known(values > limit(high))
+        return outside
+    return Rule(column, reason, failing)
+
+def before(column, other, reason):
+    # column has to come strictly before other on the same row
+    return Rule(column, reason, lambda df, raw: known(df[column] >= df[other]), needs = (other,))
+
+def not_before(column, other, reason):
+    return Rule(column, reason, lambda df, raw: known(df[column] < df[other]), needs = (other,))
+
+def matches(column, pattern, reason, raw = False, ignore = '', corrections = None, otherwise = np.nan):
+    # Checks a value's text against pattern (all of it has to match).  With raw it's the text from the raw sheet
+    # that's checked, for columns whose cleaner turns it into something else, but only where the cleaned value
+    # isn't already blank.  ignore is characters taken out before checking.  Failing text found in corrections
+    # gets that value, and anything else gets otherwise
+    corrections = corrections or {}
+    def text(df, raw_df):
+        values = (raw_df if raw else df)[column]
+        return values.str.replace(f"[{ignore}]", '', regex = True) if ignore else values
+
+    def failing(df, raw_df):
+        present = df[column].notna().to_numpy()
+        return present & ~known(text(df, raw_df).str.fullmatch(pattern))
+
+    def fix(df, raw_df, failing):
+        return np.array([corrections.get(value, otherwise) for value in text(df, raw_df)[failing]], dtype = object)
+    return Rule(column, reason, failing, fix)
+
+
+def validate(df, raw, rules, derived = None):
+    # df is the cleaned frame and raw the sheet it came from, same rows.  derived maps a column to the columns
+    # worked out from it (DOB -> YOB, age_at_request), which are blanked too wherever it is.  Hands back the
+    # fixed frame and the reasons for every row that broke something, joined with '; '
+    derived = derived or {}
+    # A frame without some of the columns (clean() on part of the sheet) just skips the rules about them
+    rules = [rule for rule in rules if rule.column in df and all(column in df for column in rule.needs)]
+    failures = np.column_stack([rule.failing(df, raw) for rule in rules]) if rules else np.zeros((len(df), 0), dtype = bool)
+
+    fixed = {}
+    for rule, failing in zip(rules, failures.T):
+        if not failing.any():
+            continue
+        values = fixed.get(rule.column, df[rule.column])
+        if rule.fix is None:
+            fixed[rule.column] = values.mask(failing)
+            blanked = failing
+        else:
+            new_values = rule.fix(df, raw, failing)
+            values = values.copy()
+            values[failing] = new_values
+            fixed[rule.column] = values
+            blanked = failing.copy()
+            blanked[failing] = pd.isna(new_values)
+        for column in derived.get(rule.column, []):
+            if column in df:
+                fixed[column] = fixed.get(column, df[column]).mask(blanked)
+
+    # Only a few rows ever fail, so the reasons are only put together for those
+    broken = failures.any(axis = 1)
+    reasons = np.array([rule.reason for rule in rules], dtype = object)
+    reasons = pd.Series(['; '.join(reasons[row]) for row in failures[broken]], index = df.index[broken], dtype = object)
+    return df.assign(**fixed), reasons
+
+
+def write_quarantine(raw, reasons, quarantine_path = CLEANED_QUARANTINE):
+    # The raw rows as they are in the sheet, with the line they're on (the header is line 1) and what's wrong
+    rows = raw.loc[reasons.index]
+    rows.insert(0, 'Reasons', reasons)
+    rows.insert(0, 'Sheet Row', reasons.index + 2)
+    rows.to_csv(quarantine_path, index = False)
+    return len(rows)